@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""benchmark the shared cache server against a slow stub origin"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+
+from cache_server import SubtitleCache, make_server
+
+
+def origin_handler(latency: float, size: int):
+    body = b"x" * size
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(port, paths, clients):
+    def get(path):
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}") as response:
+            return response.read()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        list(executor.map(get, paths))
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--requests", type=int, default=200, help="number of requests"
+    )
+    parser.add_argument(
+        "-u", "--unique", type=int, default=20, help="number of distinct paths"
+    )
+    parser.add_argument(
+        "-c", "--clients", type=int, default=8, help="number of concurrent clients"
+    )
+    parser.add_argument(
+        "-l", "--latency", type=float, default=0.2, help="origin latency, seconds"
+    )
+    parser.add_argument(
+        "-s", "--size", type=int, default=64 * 1024, help="response size, bytes"
+    )
+    args = parser.parse_args()
+
+    origin = serve(
+        ThreadingHTTPServer(("127.0.0.1", 0), origin_handler(args.latency, args.size))
+    )
+    paths = [f"/subtitle/{i % args.unique}" for i in range(args.requests)]
+
+    with tempfile.TemporaryDirectory() as store:
+        cache = SubtitleCache(store, f"http://127.0.0.1:{origin.server_port}")
+        server = serve(make_server(cache, "127.0.0.1", 0, quiet=True))
+
+        direct = run(origin.server_port, paths, args.clients)
+        cold = run(server.server_port, paths, args.clients)
+        warm = run(server.server_port, paths, args.clients)
+
+        print(
+            f"requests: {args.requests}, distinct: {args.unique}, "
+            f"clients: {args.clients}, origin latency: {args.latency}s"
+        )
+        for label, elapsed in (
+            ("origin only:", direct),
+            ("cache, cold:", cold),
+            ("cache, warm:", warm),
+        ):
+            print(
+                f"{label:14s} {elapsed * 1000:8.2f} ms "
+                f"{args.requests / elapsed:8.1f} req/s"
+            )
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""benchmark addons.xml generation over a synthetic repository"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import contextlib
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+)
+
+from publish import Generator
+
+ADDON_XML = """<?xml version="1.0" ?>
+<addon id="{addon}" name="{addon}" provider-name="bench" version="1.0.{i}">
+    <requires>
+        <import addon="xbmc.python" version="3.0.0"/>
+        <import addon="script.module.requests" version="2.27.1"/>
+    </requires>
+    <extension library="service.py" point="xbmc.subtitle.module"/>
+    <extension point="xbmc.addon.metadata">
+        <summary lang="en">Benchmark addon {i}</summary>
+        <description lang="en">Synthetic addon used to benchmark publish.py</description>
+        <platform>all</platform>
+        <assets>
+            <icon>icon.png</icon>
+        </assets>
+        <news>V1.0.{i}
+- Change {i}</news>
+    </extension>
+</addon>
+"""
+
+
+def run(addons, cache_path):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        Generator(addons, "addons.xml", "addons.xml.md5", cache_path)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--addons", type=int, default=500, help="number of synthetic addons"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="number of runs per scenario"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        addons = []
+        for i in range(args.addons):
+            addon = f"service.bench.{i:04d}"
+            os.mkdir(addon)
+            with open(os.path.join(addon, "addon.xml"), "w") as addon_xml:
+                addon_xml.write(ADDON_XML.format(addon=addon, i=i))
+            addons.append(addon)
+
+        cold = min(run(addons, None) for _ in range(args.repeat))
+        run(addons, "cache.json")
+        warm = min(run(addons, "cache.json") for _ in range(args.repeat))
+
+        print(f"addons: {args.addons}")
+        print(f"cold (no cache):  {cold * 1000:8.2f} ms")
+        print(f"warm (cached):    {warm * 1000:8.2f} ms")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""benchmark rendering of search results: per-item vs batched
+
+Runs against the Kodi stubs (requirements-dev.txt), so it measures the
+Python side of the rendering path, not the IPC into Kodi.
+"""
+
+import os
+import sys
+import time
+import urllib.parse
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "service.subtitles.a4k"
+    )
+)
+
+import xbmcaddon
+import xbmcgui
+import xbmcplugin
+
+from base_adapter import SubtitleAdapterBase, SubtitleListItem, SubtitleSearchInput
+
+
+class StaticAdapter(SubtitleAdapterBase):
+    def __init__(self, results):
+        super().__init__(xbmcaddon.Addon())
+        self._results = results
+
+    def search(self, item):
+        return self._results
+
+    def download(self, item_id):
+        raise NotImplementedError()
+
+
+def render_per_item(handle, addon_id, subtitles_list):
+    # rendering path before batching, kept as the baseline. It builds urls
+    # with the same parameters as search_handler, so only the rendering differs
+    item_ids = [it.item_id for it in subtitles_list]
+    for i, it in enumerate(subtitles_list):
+        listitem = xbmcgui.ListItem(label=it.language_name, label2=it.name)
+        listitem.setArt(
+            {"icon": str(min(it.rating, it.MAX_RATING)), "thumb": it.language_flag}
+        )
+        paramstring = urllib.parse.urlencode(
+            {
+                "action": "download",
+                "item_id": it.item_id,
+                "name": it.name,
+                "language_code": it.language_code,
+                "language_name": it.language_name,
+                "language_flag": it.language_flag,
+                "fallback": ",".join(
+                    item_ids[i + 1 : i + 1 + SubtitleAdapterBase.MAX_FALLBACKS]
+                ),
+            }
+        )
+        url = f"plugin://{addon_id}/?{paramstring}"
+        xbmcplugin.addDirectoryItem(
+            handle=handle, url=url, listitem=listitem, isFolder=False
+        )
+    xbmcplugin.endOfDirectory(handle)
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--results", type=int, default=2000, help="number of search results"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=20, help="number of runs per scenario"
+    )
+    args = parser.parse_args()
+
+    results = [
+        SubtitleListItem(
+            name=f"[zip]The.Wandering.Earth.2019.720p.BluRay.x264-WiKi.{i}.zip",
+            item_id=f"/subtitle/{100000 + i}",
+            time="2020-06-10",
+            language_code="zh",
+            language_name="简体",
+            language_flag="zh",
+            rating=0,
+        )
+        for i in range(args.results)
+    ]
+    sa = StaticAdapter(results)
+
+    per_item = best_of(
+        args.repeat, render_per_item, 1, "service.subtitles.a4k", results
+    )
+    batched = best_of(
+        args.repeat, sa.search_handler, 1, SubtitleSearchInput([], [], "流浪地球")
+    )
+
+    print(f"results: {args.results}")
+    print(
+        f"per item: {per_item * 1000:8.2f} ms  {per_item / args.results * 1e6:6.2f} us/item"
+    )
+    print(
+        f"batched:  {batched * 1000:8.2f} ms  {batched / args.results * 1e6:6.2f} us/item"
+    )
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""benchmark subtitle retiming on files with many cues"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "service.subtitles.a4k"
+    )
+)
+
+from retiming import Retiming, retime
+
+
+def srt(cues):
+    return "".join(
+        f"{i + 1}\r\n{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d},000 --> "
+        f"{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d},900\r\n第{i}句台词\r\nLine {i}\r\n\r\n"
+        for i in range(cues)
+    ).encode("utf-8")
+
+
+def ass(cues):
+    return (
+        "[Script Info]\r\nScriptType: v4.00+\r\n\r\n[Events]\r\n"
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\r\n"
+        + "".join(
+            f"Dialogue: 0,{i // 3600}:{i // 60 % 60:02d}:{i % 60:02d}.00,"
+            f"{i // 3600}:{i // 60 % 60:02d}:{i % 60:02d}.90,Default,,0,0,0,,第{i}句台词\r\n"
+            for i in range(cues)
+        )
+    ).encode("utf-8")
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-c", "--cues", type=int, default=50_000, help="number of cues per file"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="number of runs per format"
+    )
+    args = parser.parse_args()
+
+    retiming = Retiming.from_fps(25, 24000 / 1001)
+    for extension, content in ((".srt", srt(args.cues)), (".ass", ass(args.cues))):
+        elapsed = min(
+            _timed(retime, extension, content, retiming) for _ in range(args.repeat)
+        )
+        print(
+            f"{extension:5s} {args.cues:8d} cues {elapsed * 1000:10.2f} ms "
+            f"{elapsed / args.cues * 1e6:8.2f} us/cue"
+        )
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""benchmark subtitle validation on large synthetic files
+
+srt is checked on a bounded prefix, so its cost does not grow with the file: it
+is reported as latency per call. The other formats are scanned to the end, or
+as far as the events past the embedded fonts of ass, and are reported as
+throughput.
+"""
+
+import io
+import os
+import sys
+import time
+import zipfile
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "service.subtitles.a4k"
+    )
+)
+
+from validation import validate
+
+
+def srt(size):
+    cues = []
+    total = 0
+    i = 0
+    while total < size:
+        cue = (
+            f"{i + 1}\r\n00:{i // 60 % 60:02d}:{i % 60:02d},000 --> "
+            f"00:{i // 60 % 60:02d}:{i % 60:02d},900\r\n第{i}句台词\r\nLine {i}\r\n\r\n"
+        ).encode("utf-8")
+        cues.append(cue)
+        total += len(cue)
+        i += 1
+    return b"".join(cues)
+
+
+def ass(size):
+    # embedded fonts come before the events, as in real files
+    fonts = b"[Fonts]\r\nfontname: font.ttf\r\n" + b"M" * 80 * (size // 2 // 80)
+    events = srt(size // 2).replace(b" --> ", b",Default,,Dialogue: ")
+    return (
+        b"[Script Info]\r\nScriptType: v4.00+\r\n\r\n"
+        + fonts
+        + b"\r\n[Events]\r\nFormat: Layer, Start, End, Style, Text\r\n"
+        + events
+    )
+
+
+def sup(size):
+    segment = b"PG" + bytes(8) + b"\x15" + (1000).to_bytes(2, "big") + bytes(1000)
+    return segment * (size // len(segment))
+
+
+def archive(size):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        for i in range(3):
+            z.writestr(f"sub.{i}.srt", srt(size // 3))
+    return buffer.getvalue()
+
+
+# scanned past the prefix: for the events of ass, the segment headers of sup and
+# the CRCs of zip
+FULL_SCAN_EXTS = (".ass", ".sup", ".zip")
+
+
+def run(extension, content, repeat):
+    return min(_timed(validate, extension, content) for _ in range(repeat))
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    assert func(*args) is None
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s", "--size", type=int, default=32, help="size of each file, MiB"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="number of runs per format"
+    )
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    for extension, content in (
+        (".srt", srt(size)),
+        (".ass", ass(size)),
+        (".sup", sup(size)),
+        (".zip", archive(size)),
+    ):
+        elapsed = run(extension, content, args.repeat)
+        size_mib = len(content) / 1024 / 1024
+        if extension in FULL_SCAN_EXTS:
+            result = f"{size_mib / elapsed:10.1f} MiB/s"
+        else:
+            result = f"{elapsed * 1_000_000:10.1f} us/call"
+        print(f"{extension:5s} {size_mib:8.1f} MiB {result}")
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""benchmark dialog open latency: in-process (cold) vs resident worker (warm)
+
+Every run starts a fresh interpreter, as Kodi does for each plugin call, and
+measures the time until the search results are available. a4k.net is played
+by a local origin serving the recorded pages of tests/fixtures, which delays
+every new connection by --connect-ms to stand for the TCP and TLS handshakes,
+and every request by --rtt-ms. Each run searches a new term, so neither the
+worker's result cache nor the request coordinator's serve it: the worker
+still fetches and parses every search, and only saves the interpreter start,
+the imports, and the connection setup when its connection is reused.
+
+Requires the packages of requirements-dev.txt (Kodistubs, bs4, requests).
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import itertools
+import threading
+import statistics
+import subprocess
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.join(BENCH_DIR, "..", "service.subtitles.a4k")
+FIXTURES = os.path.join(BENCH_DIR, "..", "tests", "fixtures", "a4k")
+
+COLD = """
+import sys
+sys.path.insert(0, {bench_dir!r})
+from bench_worker import idle_kodi
+idle_kodi({profile!r})
+sys.path.insert(0, {addon_dir!r})
+from adapter import A4KAdapter
+from base_adapter import SubtitleSearchInput
+A4KAdapter.URL_BASE = {origin!r}
+sa = A4KAdapter()
+sa.coordinator().RATE = 1000.0
+assert sa.search(SubtitleSearchInput([], [], {term!r}))
+"""
+
+WARM = """
+import sys
+sys.path.insert(0, {bench_dir!r})
+from bench_worker import idle_kodi
+idle_kodi({profile!r})
+sys.path.insert(0, {addon_dir!r})
+import xbmcaddon
+from base_adapter import SubtitleSearchInput
+from worker import RemoteAdapter, WorkerClient
+assert RemoteAdapter(xbmcaddon.Addon(), WorkerClient({worker_file!r}), None).search(
+    SubtitleSearchInput([], [], {term!r})
+)
+"""
+
+
+def idle_kodi(profile):
+    """
+    Kodistubs return True for every bool and "" for every string, i.e. Kodi
+    exiting and no addon profile. Stub an idle Kodi instead, as
+    tests/conftest.py does.
+    """
+    import xbmc, xbmcaddon, xbmcvfs
+
+    info = {"id": "service.subtitles.a4k", "name": "a4k", "profile": profile}
+    for patch in (
+        mock.patch.object(xbmc.Monitor, "abortRequested", return_value=False),
+        mock.patch.object(xbmc.Player, "isPlayingVideo", return_value=False),
+        mock.patch("xbmc.getCondVisibility", return_value=False),
+        mock.patch.object(
+            xbmcaddon.Addon, "getAddonInfo", side_effect=lambda key: info[key]
+        ),
+        mock.patch("xbmcvfs.translatePath", side_effect=lambda path: path),
+        mock.patch("xbmcvfs.exists", side_effect=os.path.exists),
+        mock.patch(
+            "xbmcvfs.mkdirs", side_effect=lambda path: os.makedirs(path) or True
+        ),
+    ):
+        patch.start()
+
+
+class StubOrigin(BaseHTTPRequestHandler):
+    # keep-alive, as a4k.net
+    protocol_version = "HTTP/1.1"
+    connect_delay = 0.0
+    request_delay = 0.0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StubOrigin.connections += 1
+        time.sleep(self.connect_delay)
+
+    def do_GET(self):
+        time.sleep(self.request_delay)
+        with open(os.path.join(FIXTURES, "search.html"), "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Monitor:
+    def __init__(self):
+        self._abort = threading.Event()
+
+    def abortRequested(self):
+        return self._abort.is_set()
+
+    def waitForAbort(self, timeout):
+        return self._abort.wait(timeout)
+
+    def abort(self):
+        self._abort.set()
+
+
+def measure(code, terms, repeat, before=None):
+    timings = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code.format(term=next(terms))], check=True
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(
+        f"{name:<22} median {statistics.median(timings) * 1000:8.1f} ms"
+        f"  min {min(timings) * 1000:8.1f} ms  max {max(timings) * 1000:8.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=10, help="number of runs per scenario"
+    )
+    parser.add_argument(
+        "-c",
+        "--connect-ms",
+        type=float,
+        default=150,
+        help="delay of a new connection to the origin, ms",
+    )
+    parser.add_argument(
+        "-t", "--rtt-ms", type=float, default=50, help="delay of each request, ms"
+    )
+    args = parser.parse_args()
+
+    StubOrigin.connect_delay = args.connect_ms / 1000
+    StubOrigin.request_delay = args.rtt_ms / 1000
+    origin = ThreadingHTTPServer(("127.0.0.1", 0), StubOrigin)
+    origin.daemon_threads = True
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    origin_url = f"http://127.0.0.1:{origin.server_port}"
+    terms = (f"流浪地球 {i}" for i in itertools.count())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profile = os.path.join(tmp_dir, "profile")
+        idle_kodi(profile)
+        sys.path.insert(0, ADDON_DIR)
+        from adapter import A4KAdapter
+        from worker import AdapterWorker
+
+        fields = dict(bench_dir=BENCH_DIR, addon_dir=ADDON_DIR, profile=profile)
+        cold_code = COLD.format(origin=origin_url, term="{term}", **fields)
+        cold = measure(cold_code, terms, args.repeat)
+
+        worker_file = os.path.join(tmp_dir, "worker.json")
+        A4KAdapter.URL_BASE = origin_url
+        adapter = A4KAdapter()
+        adapter.coordinator().RATE = 1000.0
+        monitor = Monitor()
+        worker = threading.Thread(
+            target=AdapterWorker(adapter).serve, args=(monitor, worker_file)
+        )
+        worker.start()
+        while not os.path.exists(worker_file):
+            time.sleep(0.01)
+
+        warm_code = WARM.format(worker_file=worker_file, term="{term}", **fields)
+        # drop the worker's connection before each run
+        connections = StubOrigin.connections
+        new_connection = measure(warm_code, terms, args.repeat, adapter._session.close)
+        new_connections = StubOrigin.connections - connections
+
+        connections = StubOrigin.connections
+        reused = measure(warm_code, terms, args.repeat)
+        reused_connections = StubOrigin.connections - connections
+
+        monitor.abort()
+        worker.join()
+
+    print(
+        f"connect {args.connect_ms:.0f} ms, request {args.rtt_ms:.0f} ms,"
+        f" {args.repeat} runs"
+    )
+    report("cold (in-process)", cold)
+    report(f"worker, new conn ({new_connections})", new_connection)
+    report(f"worker, warm conn ({reused_connections})", reused)
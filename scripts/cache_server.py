@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+""" shared subtitle cache server
+
+A caching HTTP proxy in front of a4k.net, for LAN with many Kodi boxes.
+Set its url as "Shared cache server" in the settings of service.subtitles.a4k;
+the addon queries it first and falls back to a4k.net when it is unreachable.
+
+Cache coherence:
+- /search pages are cached for --search-ttl seconds.
+- everything else (subtitle pages, subtitle files) is immutable, cached until
+  evicted. Only responses that look like the real thing are kept: files that
+  pass the addon's validation, and pages linking to their file. Soft errors
+  and challenge pages of the origin also come as 200.
+- only 200 responses are cached, errors are passed through.
+- the store is kept under --max-size, evicting the least recently used entries.
+"""
+
+from typing import List, Optional, Tuple
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import contextlib
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import argparse
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "service.subtitles.a4k"
+    )
+)
+
+from validation import validate
+
+ORIGIN = "https://www.a4k.net"
+# subtitle pages link to their file from this element
+DOWNLOAD_LINK = b'class="download"'
+USER_AGENT = "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; Trident/6.0)"
+
+CacheResult = Tuple[int, str, bytes, bool]  # status, content type, body, hit
+CacheEntry = Tuple[float, int, str]  # last used, size, path of the body
+
+
+class SubtitleCache:
+    """
+    Disk backed cache of origin responses, keyed by request path. Concurrent
+    misses on the same path are fetched from the origin once.
+    """
+
+    # share of max_size the store is brought back to when it goes over
+    EVICT_TO: float = 0.9
+
+    def __init__(
+        self,
+        store: str,
+        origin: str = ORIGIN,
+        search_ttl: float = 600,
+        timeout=30,
+        max_size: int = 1024 * 1024 * 1024,
+    ):
+        self._store = store
+        self._origin = origin.rstrip("/")
+        self._search_ttl = search_ttl
+        self._timeout = timeout
+        self._max_size = max_size
+        # striped locks, so memory stays bounded however many paths are seen
+        self._locks = [threading.Lock() for _ in range(64)]
+        os.makedirs(store, exist_ok=True)
+        self._size_lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def ttl(self, path: str) -> Optional[float]:
+        """
+        :param path: request path
+        :return: seconds the response stays fresh, None if it never expires
+        """
+        return self._search_ttl if path.startswith("/search") else None
+
+    def cacheable(self, path: str, content_type: str, body: bytes) -> bool:
+        """
+        :param path: request path
+        :param content_type: content type of the 200 response
+        :param body: body of the response
+        :return: whether the response looks like the real thing, and not an
+        error page of the origin
+        """
+        if self.ttl(path) is not None:
+            return True
+        extension = os.path.splitext(urllib.parse.urlsplit(path).path)[1]
+        if extension:
+            return validate(extension, body) is None
+        return content_type.startswith("text/html") and DOWNLOAD_LINK in body
+
+    def _entries(self) -> List[CacheEntry]:
+        entries = []
+        for name in os.listdir(self._store):
+            if not name.endswith(".json"):
+                continue
+            body_path = os.path.join(self._store, name[: -len(".json")])
+            try:
+                entries.append(
+                    (
+                        os.stat(f"{body_path}.json").st_mtime,
+                        self._entry_size(body_path),
+                        body_path,
+                    )
+                )
+            except OSError:
+                continue
+        return entries
+
+    @staticmethod
+    def _entry_size(entry_path: str) -> int:
+        return os.path.getsize(entry_path) + os.path.getsize(f"{entry_path}.json")
+
+    def _evict(self):
+        """
+        Remove the least recently used entries, until the store is back under
+        EVICT_TO of max_size
+        """
+        with self._size_lock:
+            if self._size <= self._max_size:
+                return
+            entries = sorted(self._entries())
+            size = sum(entry_size for _, entry_size, _ in entries)
+            for _, entry_size, body_path in entries:
+                if size <= self._max_size * self.EVICT_TO:
+                    break
+                # metadata first, so the entry is a miss from then on
+                for suffix in (".json", ""):
+                    with contextlib.suppress(OSError):
+                        os.remove(f"{body_path}{suffix}")
+                size -= entry_size
+            self._size = size
+
+    def _entry_path(self, path: str) -> str:
+        return os.path.join(self._store, hashlib.sha256(path.encode()).hexdigest())
+
+    def _lock(self, path: str) -> threading.Lock:
+        return self._locks[hash(path) % len(self._locks)]
+
+    def _read(self, path: str) -> Optional[CacheResult]:
+        entry_path = self._entry_path(path)
+        try:
+            with open(f"{entry_path}.json", "r") as meta_file:
+                meta = json.load(meta_file)
+            ttl = self.ttl(path)
+            if ttl is not None and time.time() - meta["stored"] > ttl:
+                return None
+            with open(entry_path, "rb") as body_file:
+                body = body_file.read()
+            # the metadata's mtime is the last use, for eviction
+            os.utime(f"{entry_path}.json")
+            return 200, meta["content_type"], body, True
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: str, content_type: str, body: bytes):
+        entry_path = self._entry_path(path)
+        meta = {"content_type": content_type, "stored": time.time()}
+        try:
+            # replaced, e.g. an expired search
+            replaced = self._entry_size(entry_path)
+        except OSError:
+            replaced = 0
+        # write body first and replace atomically, so readers never see
+        # metadata of a partial body
+        for suffix, data in (("", body), (".json", json.dumps(meta).encode())):
+            tmp_path = f"{entry_path}{suffix}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, f"{entry_path}{suffix}")
+        with self._size_lock:
+            self._size += self._entry_size(entry_path) - replaced
+        self._evict()
+
+    def _fetch(self, path: str) -> Tuple[int, str, bytes]:
+        request = urllib.request.Request(
+            f"{self._origin}{path}", headers={"User-Agent": USER_AGENT}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self._timeout) as response:
+                return (
+                    response.status,
+                    response.headers.get("Content-Type", "application/octet-stream"),
+                    response.read(),
+                )
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get("Content-Type", "text/plain"), e.read()
+
+    def get(self, path: str) -> CacheResult:
+        """
+        :param path: request path, including the query string
+        :return: status, content type, body and whether it was a cache hit
+        """
+        cached = self._read(path)
+        if cached is not None:
+            return cached
+
+        with self._lock(path):
+            # another thread may have fetched it while we waited
+            cached = self._read(path)
+            if cached is not None:
+                return cached
+
+            status, content_type, body = self._fetch(path)
+            if status == 200 and self.cacheable(path, content_type, body):
+                self._write(path, content_type, body)
+            return status, content_type, body, False
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    cache: SubtitleCache = None
+    quiet: bool = False
+
+    def do_GET(self):
+        try:
+            status, content_type, body, hit = self.cache.get(self.path)
+        except OSError as e:
+            status, content_type, body, hit = 502, "text/plain", str(e).encode(), False
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Cache", "HIT" if hit else "MISS")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+class CacheServer(ThreadingHTTPServer):
+    # the default listen backlog (5) drops connections when a few boxes
+    # search at once, and a dropped SYN costs a 1s retransmit
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_server(
+    cache: SubtitleCache, host: str = "0.0.0.0", port: int = 8080, quiet=False
+) -> CacheServer:
+    handler = type(
+        "Handler", (CacheRequestHandler,), {"cache": cache, "quiet": quiet}
+    )
+    return CacheServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--store', type=str, default="subtitle-cache",
+                        help='cache directory')
+    parser.add_argument('-o', '--origin', type=str, default=ORIGIN,
+                        help='origin to cache')
+    parser.add_argument('-b', '--bind', type=str, default="0.0.0.0",
+                        help='address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8080,
+                        help='port to listen on')
+    parser.add_argument('-t', '--search-ttl', type=float, default=600,
+                        help='seconds search results stay cached')
+    parser.add_argument('-m', '--max-size', type=int, default=1024,
+                        help='size of the cache directory, MiB')
+    args = parser.parse_args()
+
+    server = make_server(
+        SubtitleCache(
+            args.store,
+            args.origin,
+            args.search_ttl,
+            max_size=args.max_size * 1024 * 1024,
+        ),
+        args.bind,
+        args.port,
+    )
+    print(f"Serving {args.origin} on {args.bind}:{args.port}, cache in {args.store}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
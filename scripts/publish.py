@@ -23,14 +23,157 @@
 
 """ addons.xml generator """
 
-from typing import List
+from typing import Dict, List, Optional, Tuple
+import io
 import os
 import sys
+import glob
+import gzip
+import json
 import hashlib
+import contextlib
+import xml.etree.ElementTree as ET
 
 import argparse
 
-from bs4 import BeautifulSoup
+XML_HEADER = '<?xml version="1.0" ?>\n'
+INDENT = " " * 4
+CHUNK_SIZE = 1024 * 1024
+
+
+def _escape(data: str) -> str:
+    # same escaping as xml.dom.minidom, so the output stays byte-identical to
+    # the files published before
+    return (
+        data.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace('"', "&quot;")
+        .replace(">", "&gt;")
+    )
+
+
+def serialize(elem: ET.Element, indent: str = "") -> str:
+    """
+    Serialize an element the way minidom's toprettyxml does once blank text
+    has been stripped: one node per line, text-only elements kept inline.
+    :param elem: element to serialize
+    :param indent: indentation of the element itself
+    :return: serialized element, ending with a newline
+    """
+    attrs = "".join(f' {k}="{_escape(v)}"' for k, v in elem.attrib.items())
+
+    # flatten text/children/tail into the node list minidom would see
+    nodes = []
+    if elem.text and elem.text.strip():
+        nodes.append(elem.text.strip())
+    for child in elem:
+        nodes.append(child)
+        if child.tail and child.tail.strip():
+            nodes.append(child.tail.strip())
+
+    if not nodes:
+        return f"{indent}<{elem.tag}{attrs}/>\n"
+    if len(nodes) == 1 and isinstance(nodes[0], str):
+        return f"{indent}<{elem.tag}{attrs}>{_escape(nodes[0])}</{elem.tag}>\n"
+
+    child_indent = indent + INDENT
+    parts = [f"{indent}<{elem.tag}{attrs}>\n"]
+    for node in nodes:
+        if isinstance(node, str):
+            parts.append(_escape(f"{child_indent}{node}\n"))
+        else:
+            parts.append(serialize(node, child_indent))
+    parts.append(f"{indent}</{elem.tag}>\n")
+    return "".join(parts)
+
+
+class HashingWriter:
+    """
+    File-like wrapper feeding everything written through it to a hash
+    """
+
+    def __init__(self, fileobj, hasher):
+        self._fileobj = fileobj
+        self._hasher = hasher
+
+    def write(self, data: bytes) -> int:
+        self._hasher.update(data)
+        return self._fileobj.write(data)
+
+    def flush(self):
+        self._fileobj.flush()
+
+
+def sha256_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class FragmentCache:
+    """
+    Keeps the serialized <addon> fragments of every addon.xml, keyed by path.
+    An entry is reused when mtime and size are unchanged, or when the content
+    hash still matches (e.g. the file was only touched).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._entries: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as cache_file:
+                    self._entries = json.load(cache_file)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring broken cache {path}: {e}")
+
+    def fragments(self, addon_path: str) -> List[str]:
+        stat = os.stat(addon_path)
+        entry = self._entries.get(addon_path)
+        if (
+            entry is not None
+            and entry["mtime_ns"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            self.hits += 1
+            return entry["fragments"]
+
+        with open(addon_path, "rb") as addon_xml:
+            data = addon_xml.read()
+        digest = hashlib.sha1(data).hexdigest()
+
+        if entry is not None and entry["sha1"] == digest:
+            self.hits += 1
+            fragments = entry["fragments"]
+        else:
+            self.misses += 1
+            fragments = [
+                serialize(elem, INDENT)
+                for _, elem in ET.iterparse(io.BytesIO(data), events=("end",))
+                if elem.tag == "addon"
+            ]
+
+        self._entries[addon_path] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha1": digest,
+            "fragments": fragments,
+        }
+        return fragments
+
+    def save(self):
+        if not self._path:
+            return
+        try:
+            with open(self._path, "w", encoding="utf-8") as cache_file:
+                json.dump(self._entries, cache_file, ensure_ascii=False)
+        except OSError as e:
+            print(f"An error occurred saving {self._path} file!\n{e}")
 
 
 class Generator:
@@ -38,17 +181,39 @@ class Generator:
         Generates a new addons.xml file from each addons addon.xml file
         and a new addons.xml.md5 hash file. Must be run from the root of
         the checked-out repo. Only handles single depth folder structure.
+
+        addons.xml is written in a single pass: every addon.xml is read at
+        most once, and the md5 is computed while the index is being written.
+        When gz_path is given, a gzip copy of the index and its sha256 file
+        (<gz_path>.sha256) are produced in the same pass. When dest is given,
+        a <zip>.sha256 file is written next to every released zip.
     """
 
-    def __init__(self, addons: List[str], xml_path: str, md5_path: str):
+    def __init__(
+        self,
+        addons: List[str],
+        xml_path: str,
+        md5_path: str,
+        cache_path: Optional[str] = None,
+        gz_path: Optional[str] = None,
+        dest: Optional[str] = None,
+    ):
+        self._cache = FragmentCache(cache_path)
         # generate files
-        self._generate_addons_file(addons, xml_path)
-        self._generate_md5_file(xml_path, md5_path)
+        md5, gz_sha256 = self._generate_addons_file(addons, xml_path, gz_path)
+        self._save_file(md5.encode("UTF-8"), file=md5_path)
+        if gz_path:
+            self._save_file(gz_sha256.encode("UTF-8"), file=f"{gz_path}.sha256")
+        if dest:
+            self._generate_zip_checksums(addons, dest)
+        self._cache.save()
         # notify user
-        print("Finished updating addons xml and md5 files")
+        print("Finished updating addons xml and checksum files")
 
-    def _generate_addons_file(self, addons: List[str], xml_path: str):
-        addon_soups = []
+    def _generate_addons_file(
+        self, addons: List[str], xml_path: str, gz_path: Optional[str]
+    ) -> Tuple[str, Optional[str]]:
+        fragments = []
 
         for addon in sorted(addons):
             try:
@@ -63,35 +228,66 @@ class Generator:
                         f"Could NOT find addon.xml for addon: {addon}")
                     continue
 
-                with open(addon_path, "r") as addon_xml:
-                    addon_xml_cont = addon_xml.read()
-                    soup = BeautifulSoup(addon_xml_cont, "xml")
-                    addon_soups += soup.find_all("addon")
-
+                fragments += self._cache.fragments(addon_path)
 
             except Exception as e:
                 # missing or poorly formatted addon.xml
                 print(f"Excluding {addon} for {e}")
 
-        final_soup = BeautifulSoup("""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
-        <addons>
-        </addons>
-        """, "xml")
-        for addon_node in addon_soups:
-            final_soup.find("addons").append(addon_node)
+        md5 = hashlib.md5()
+        gz_sha256 = hashlib.sha256()
+        try:
+            with contextlib.ExitStack() as stack:
+                target_file = stack.enter_context(open(xml_path, "wb"))
+                gz_file = None
+                if gz_path:
+                    # mtime=0 keeps the archive reproducible for the same index
+                    gz_file = stack.enter_context(
+                        gzip.GzipFile(
+                            filename="",
+                            mode="wb",
+                            mtime=0,
+                            fileobj=HashingWriter(
+                                stack.enter_context(open(gz_path, "wb")), gz_sha256
+                            ),
+                        )
+                    )
 
-        # save file
-        self._save_file(final_soup.prettify().encode("utf-8"),
-                        file=xml_path)
-        self.remove_blanks_in_xml(xml_path)
+                def write(text: str):
+                    data = text.encode("utf-8")
+                    target_file.write(data)
+                    md5.update(data)
+                    if gz_file is not None:
+                        gz_file.write(data)
+
+                write(XML_HEADER)
+                if not fragments:
+                    write("<addons/>\n")
+                else:
+                    write("<addons>\n")
+                    for fragment in fragments:
+                        write(fragment)
+                    write("</addons>\n")
+        except Exception as e:
+            # oops
+            print(f"An error occurred saving {xml_path} file!\n{e}")
 
-    def _generate_md5_file(self, xml_path: str, md5_path: str):
-        # create a new md5 hash
-        m = hashlib.md5(open(xml_path, "r", encoding="UTF-8").read().encode(
-            "UTF-8")).hexdigest()
+        return md5.hexdigest(), gz_sha256.hexdigest() if gz_path else None
 
-        # save file
-        self._save_file(m.encode("UTF-8"), file=md5_path)
+    def _generate_zip_checksums(self, addons: List[str], dest: str):
+        for addon in sorted(addons):
+            for zip_path in sorted(glob.glob(os.path.join(dest, addon, "*.zip"))):
+                sha256_path = f"{zip_path}.sha256"
+                # released zips are immutable, only hash new or rebuilt ones
+                if (
+                    os.path.exists(sha256_path)
+                    and os.stat(sha256_path).st_mtime_ns
+                    >= os.stat(zip_path).st_mtime_ns
+                ):
+                    continue
+                self._save_file(
+                    sha256_file(zip_path).encode("UTF-8"), file=sha256_path
+                )
 
     def _save_file(self, data: bytes, file: str):
         try:
@@ -101,23 +297,6 @@ class Generator:
             # oops
             print(f"An error occurred saving {file} file!\n{e}")
 
-    def remove_blanks_in_xml(self, file):
-        from xml.dom import minidom
-        from xml.dom.minidom import Node
-
-        def remove_blanks(node):
-            for x in node.childNodes:
-                if x.nodeType == Node.TEXT_NODE:
-                    if x.nodeValue:
-                        x.nodeValue = x.nodeValue.strip()
-                elif x.nodeType == Node.ELEMENT_NODE:
-                    remove_blanks(x)
-
-        xml = minidom.parse(file)
-        remove_blanks(xml)
-        xml.normalize()
-        with open(file, 'w') as result:
-            result.write(xml.toprettyxml(indent=" " * 4))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -128,6 +307,14 @@ if __name__ == "__main__":
                         help='xml destination')
     parser.add_argument('-m', '--md5-path', type=str, default="addons.xml.md5",
                         help='md5 destination')
+    parser.add_argument('-z', '--gz-path', type=str, default="addons.xml.gz",
+                        help='compressed xml destination')
+    parser.add_argument('-d', '--dest', type=str, default="dest",
+                        help='release destination, zips in it get sha256 files')
+    parser.add_argument('-c', '--cache-path', type=str,
+                        default=".addons_xml_cache.json",
+                        help='cache of parsed addon.xml files')
     args = parser.parse_args()
 
-    Generator(args.addons, args.xml_path, args.md5_path)
+    Generator(args.addons, args.xml_path, args.md5_path, args.cache_path,
+              args.gz_path, args.dest)
@@ -1,24 +1,44 @@
 ﻿import os
-from typing import List
+import urllib.parse
+from typing import Dict, List, Tuple
 
 import requests
 import xbmc
 import xbmcaddon
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from base_adapter import (
-    SubtitleAdapterBase,
+    AsyncSubtitleAdapterBase,
+    CancellationToken,
     SubtitleListItem,
     SubtitleDownloadedFile,
     SubtitleSearchInput,
 )
+from coordination import RequestCancelled
 
 
-class A4KAdapter(SubtitleAdapterBase):
+class A4KAdapter(AsyncSubtitleAdapterBase):
     URL_BASE = "https://www.a4k.net"
+    # connect, and read: the longest wait for the next bytes. Kodi waits for
+    # every thread of the plugin, so this bounds how long a cancelled action
+    # still holds it
+    HTTP_TIMEOUT = (5, 10)
+    # give up on an unreachable cache server quickly, but let it fetch misses
+    CACHE_SERVER_TIMEOUT = (2, HTTP_TIMEOUT[1])
+    # bodies are read in chunks, checking for cancellation in between
+    CHUNK_SIZE = 16 * 1024
+    SEARCH_TTL = 60
+    # subtitle pages and files do not change
+    DOWNLOAD_TTL = 10 * 60
+    # only the parts of the pages that are read are parsed into a tree, which
+    # would otherwise take ~20x the page size in memory
+    SEARCH_STRAINER = SoupStrainer("li", class_="item")
+    DOWNLOAD_STRAINER = SoupStrainer("div", class_="download")
 
     def __init__(self):
         super().__init__(xbmcaddon.Addon())
+        # shared by the actions running at the same time in the resident
+        # worker, each stops its own requests through its CancellationToken
         self._session = requests.session()
         self._session.headers.update(
             {
@@ -26,6 +46,15 @@ class A4KAdapter(SubtitleAdapterBase):
             }
         )
 
+    def cache_server(self) -> str:
+        """
+        Optional shared cache (scripts/cache_server.py), queried before a4k.net.
+        Read for every request, as the resident worker outlives setting changes
+        :return: url of the server, "" if none is set
+        """
+        addon = xbmcaddon.Addon(self._addon_id)
+        return addon.getSetting("cache_server").strip().rstrip("/")
+
     @staticmethod
     def _map_language(language):
         lang_map = {
@@ -36,6 +65,58 @@ class A4KAdapter(SubtitleAdapterBase):
         }
         return lang_map.get(language, "")
 
+    def _fetch(
+        self, path: str, ttl: float, token: CancellationToken
+    ) -> Tuple[bytes, Dict[str, str]]:
+        """
+        GET a path of the site, from the shared cache server if configured,
+        shared with the addon's other processes doing the same request at the
+        same time
+        :param path: path of the page or file
+        :param ttl: how long the result is shared with other requests
+        :param token: CancellationToken of the action, stops the waits on other
+        processes and on the rate limit, and the download of the body
+        :return: body and headers (lower case names)
+        :raise RequestCancelled: if the action was cancelled
+        """
+        __LOG_CATEGORY__ = "FETCH"
+
+        url = f"{A4KAdapter.URL_BASE}{path}"
+        cache_server = self.cache_server()
+
+        def get(base_url, timeout):
+            if token.is_cancelled():
+                raise RequestCancelled()
+            with self._session.get(
+                f"{base_url}{path}", timeout=timeout, stream=True
+            ) as http_response:
+                # never share error pages
+                http_response.raise_for_status()
+                headers = {k.lower(): v for k, v in http_response.headers.items()}
+                chunks = []
+                for chunk in http_response.iter_content(A4KAdapter.CHUNK_SIZE):
+                    if token.is_cancelled():
+                        raise RequestCancelled()
+                    chunks.append(chunk)
+            return b"".join(chunks), headers
+
+        def fetch():
+            if cache_server:
+                try:
+                    return get(cache_server, A4KAdapter.CACHE_SERVER_TIMEOUT)
+                except requests.RequestException as e:
+                    self.log(
+                        __LOG_CATEGORY__,
+                        f"cache server failed, using origin: {e}",
+                        level=xbmc.LOGWARNING,
+                    )
+            self.coordinator().acquire(
+                urllib.parse.urlsplit(url).hostname, token.is_cancelled
+            )
+            return get(A4KAdapter.URL_BASE, A4KAdapter.HTTP_TIMEOUT)
+
+        return self.coordinator().fetch(url, None, fetch, ttl, token.is_cancelled)
+
     def get_search_string(self, search_item: SubtitleSearchInput) -> str:
         if search_item.is_manual_search():
             return search_item.searchstring
@@ -45,19 +126,31 @@ class A4KAdapter(SubtitleAdapterBase):
             else:
                 return search_item.title()
 
-    def search(self, item: SubtitleSearchInput) -> List[SubtitleListItem]:
+    async def search_async(
+        self, item: SubtitleSearchInput, token: CancellationToken
+    ) -> List[SubtitleListItem]:
         __LOG_CATEGORY__ = "SEARCH"
 
         search_term = self.get_search_string(item)
         self.log(__LOG_CATEGORY__, f"Searching term: {search_term}", level=xbmc.LOGINFO)
 
-        url = f"{A4KAdapter.URL_BASE}/search?term={search_term}"
-        http_response = self._session.get(url)
+        http_body, _ = await self.run_blocking(
+            self._fetch, f"/search?term={search_term}", A4KAdapter.SEARCH_TTL, token
+        )
+
+        return await self.run_blocking(self._parse_search, http_body)
 
-        http_body = http_response.content
-        soup = BeautifulSoup(http_body, "html.parser")
-        list_items = soup.find_all("li", class_="item")
+    def _parse_search(self, http_body: bytes) -> List[SubtitleListItem]:
+        soup = BeautifulSoup(
+            http_body, "html.parser", parse_only=A4KAdapter.SEARCH_STRAINER
+        )
+        try:
+            return self._parse_search_items(soup.find_all("li", class_="item"))
+        finally:
+            # break the tree's reference cycles now, instead of at the next gc
+            soup.decompose()
 
+    def _parse_search_items(self, list_items) -> List[SubtitleListItem]:
         self.log("SEARCH", f"Found {len(list_items)} items")
         results = []
 
@@ -89,22 +182,37 @@ class A4KAdapter(SubtitleAdapterBase):
             )
         return results
 
-    def download(self, item_id: str) -> SubtitleDownloadedFile:
+    async def download_async(
+        self, item_id: str, token: CancellationToken
+    ) -> SubtitleDownloadedFile:
         __LOG_CATEGORY__ = "DOWNLOAD"
 
         self.log(__LOG_CATEGORY__, f"Downloa url: {item_id}", level=xbmc.LOGINFO)
 
-        http_response = self._session.get(f"{A4KAdapter.URL_BASE}{item_id}")
-        http_body = http_response.content
-
-        soup = BeautifulSoup(http_body, "html.parser")
-        download_div = soup.find("div", class_="download")
+        http_body, _ = await self.run_blocking(
+            self._fetch, item_id, A4KAdapter.DOWNLOAD_TTL, token
+        )
+        file_url = await self.run_blocking(self._parse_file_url, http_body)
+        # the page is not needed while the file is downloaded
+        del http_body
 
-        file_url = download_div.find("a", class_="green")["href"]
-        file_response = self._session.get(f"{A4KAdapter.URL_BASE}{file_url}")
+        file_body, file_headers = await self.run_blocking(
+            self._fetch, file_url, A4KAdapter.DOWNLOAD_TTL, token
+        )
         return SubtitleDownloadedFile(
             file_name=os.path.basename(file_url),
-            content_type=file_response.headers["Content-Type"],
-            content_length=int(file_response.headers["Content-Length"]),
-            content=file_response.content,
+            content_type=file_headers.get("content-type", ""),
+            content_length=int(file_headers.get("content-length", len(file_body))),
+            content=file_body,
+        )
+
+    @staticmethod
+    def _parse_file_url(http_body: bytes) -> str:
+        soup = BeautifulSoup(
+            http_body, "html.parser", parse_only=A4KAdapter.DOWNLOAD_STRAINER
         )
+        try:
+            download_div = soup.find("div", class_="download")
+            return download_div.find("a", class_="green")["href"]
+        finally:
+            soup.decompose()
@@ -1,16 +1,24 @@
 import os
 import sys
+import asyncio
 import datetime
-import urllib
+import urllib.parse
+import threading
+import contextvars
+from concurrent.futures import Executor, Future
 
-from typing import List, Optional, ClassVar, Tuple
-from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, ClassVar, Sequence, Tuple
+from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
 
 import xbmc, xbmcgui, xbmcaddon, xbmcplugin, xbmcvfs
 
+from coordination import RequestCoordinator
+from history import SubtitleChoice, SubtitleHistory, rank_by_history, video_fingerprint
+from retiming import RETIMED_EXTS, Retiming, fps_from_name, retime, snap_fps
+from validation import SUBTITLE_EXTS, validate
 
-EXTS: Tuple = (".srt", ".sub", ".smi", ".ssa", ".ass", ".sup")
+EXTS: Tuple = SUBTITLE_EXTS
 SUPPORTED_ARCHIVE_EXTS: Tuple = (
     ".zip",
     ".7z",
@@ -26,6 +34,42 @@ SUPPORTED_ARCHIVE_EXTS: Tuple = (
 )
 ACCESSIBLE_ARCHIVE_EXTS: Tuple = (".zip", ".rar")
 
+# executor of the action being run by AsyncSubtitleAdapterBase.run
+_action_executor: contextvars.ContextVar = contextvars.ContextVar("action_executor")
+
+
+class DaemonThreadExecutor(Executor):
+    """
+    Executor running each call in a daemon thread. ThreadPoolExecutor's
+    workers are joined at interpreter exit, so a blocking call of a cancelled
+    action would keep a plain python process alive until it returns. Kodi
+    waits for every thread of the plugin's interpreter, daemon or not, so
+    blocking calls must also stop on their own once the action is cancelled.
+    """
+
+    def __init__(self, max_workers: int):
+        """
+        :param max_workers: calls running at the same time, the others wait
+        """
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+
+        def run():
+            with self._slots:
+                if not future.set_running_or_notify_cancel():
+                    return
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
 
 @dataclass
 class SubtitleSearchInput:
@@ -60,6 +104,17 @@ class SubtitleSearchInput:
 
 @dataclass
 class SubtitleListItem:
+    # results are kept around until rendered, keep the records compact
+    __slots__ = (
+        "name",
+        "item_id",
+        "time",
+        "language_code",
+        "language_name",
+        "language_flag",
+        "rating",
+    )
+
     name: str
     item_id: str
     time: str
@@ -71,7 +126,10 @@ class SubtitleListItem:
     MAX_RATING: ClassVar[int] = 5
 
     def getXmbcListItem(self):
-        listitem = xbmcgui.ListItem(label=self.language_name, label2=self.name)
+        # offscreen ListItems are not bound to the GUI, so no GUI lock is taken
+        listitem = xbmcgui.ListItem(
+            label=self.language_name, label2=self.name, offscreen=True
+        )
         listitem.setArt(
             {
                 "icon": str(min(self.rating, self.MAX_RATING)),
@@ -80,24 +138,72 @@ class SubtitleListItem:
         )
         return listitem
 
+    def url_params(self) -> str:
+        """
+        query string carrying the item to the download action
+        :return:
+        """
+        quote = urllib.parse.quote_plus
+        return (
+            f"item_id={quote(self.item_id)}&name={quote(self.name)}"
+            f"&language_code={quote(self.language_code)}"
+            f"&language_name={quote(self.language_name)}"
+            f"&language_flag={quote(self.language_flag)}"
+        )
+
+    @classmethod
+    def from_params(cls, params: dict) -> "SubtitleListItem":
+        return cls(
+            name=params.get("name", ""),
+            item_id=params["item_id"],
+            time="",
+            language_code=params.get("language_code", ""),
+            language_name=params.get("language_name", ""),
+            language_flag=params.get("language_flag", ""),
+            rating=0,
+        )
+
+    @classmethod
+    def from_choice(cls, choice: SubtitleChoice) -> "SubtitleListItem":
+        return cls(
+            name=choice.name,
+            item_id=choice.item_id,
+            time="",
+            language_code=choice.language_code,
+            language_name=choice.language_name,
+            language_flag=choice.language_flag,
+            rating=cls.MAX_RATING,
+        )
+
 
 @dataclass
 class SubtitleDownloadedFile:
     file_name: str
     content_type: str
     content_length: int
-    content: bytes
+    # kept out of repr: logging a file, or asyncio taking the repr of the task
+    # returning it, would otherwise render every byte of it
+    content: bytes = field(repr=False)
 
     MIN_SIZE: ClassVar[int] = 10
 
     def is_valid(self) -> bool:
         """
-        check if downloaded file is valid based on extension and size
+        check if downloaded file is valid based on extension, size and content
         :return:
         """
-        return (
-            self.is_subtitle() or self.is_supported_archive_exts()
-        ) and self.content_length > self.MIN_SIZE
+        return self.validation_error() is None
+
+    def validation_error(self) -> Optional[str]:
+        """
+        check the downloaded file, see validation.validate
+        :return: why the file is invalid, None if it is valid
+        """
+        if not (self.is_subtitle() or self.is_supported_archive_exts()):
+            return f"unsupported extension {self.extension()}"
+        if self.content_length <= self.MIN_SIZE:
+            return f"too small, {self.content_length} bytes"
+        return validate(self.extension(), self.content)
 
     def is_subtitle(self) -> bool:
         """
@@ -122,7 +228,40 @@ class SubtitleDownloadedFile:
         return file_extension
 
 
+class SubtitleActionCancelled(Exception):
+    """
+    The action was abandoned: Kodi is exiting or the subtitle dialog was closed
+    """
+
+
+class CancellationToken:
+    SUBTITLE_DIALOG: ClassVar[str] = "Window.IsVisible(subtitlesearch)"
+
+    def __init__(self, monitor: Optional[xbmc.Monitor] = None):
+        """
+        Construct a CancellationToken for the current action
+        :param monitor: xbmc.Monitor, whose abortRequested() cancels the action
+        """
+        self._monitor = monitor or xbmc.Monitor()
+        # only watch the dialog if the action was started from it
+        self._watch_dialog = xbmc.getCondVisibility(self.SUBTITLE_DIALOG)
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self) -> bool:
+        if not self._cancelled:
+            self._cancelled = self._monitor.abortRequested() or (
+                self._watch_dialog and not xbmc.getCondVisibility(self.SUBTITLE_DIALOG)
+            )
+        return self._cancelled
+
+
 class SubtitleAdapterBase(ABC):
+    # search results a download falls back to, when the chosen one is invalid
+    MAX_FALLBACKS: ClassVar[int] = 3
+
     def __init__(self, addon: xbmcaddon.Addon):
         """
         Construct a SubtitleAdapterBase
@@ -137,6 +276,8 @@ class SubtitleAdapterBase(ABC):
         self._addon_temp = xbmcvfs.translatePath(
             os.path.join(self._addon_profile, "temp")
         )
+        self._history: Optional[SubtitleHistory] = None
+        self._coordinator: Optional[RequestCoordinator] = None
 
     def log(self, category, msg, level=xbmc.LOGDEBUG):
         xbmc.log(f"[{self._addon_name}]::{category} - {msg}", level=level)
@@ -159,6 +300,124 @@ class SubtitleAdapterBase(ABC):
         """
         pass
 
+    def history(self) -> SubtitleHistory:
+        """
+        History of the subtitles chosen by the user, opened on first use
+        :return:
+        """
+        if self._history is None:
+            if not xbmcvfs.exists(self._addon_profile):
+                xbmcvfs.mkdirs(self._addon_profile)
+            self._history = SubtitleHistory(
+                os.path.join(self._addon_profile, "history.db")
+            )
+        return self._history
+
+    def coordinator(self) -> RequestCoordinator:
+        """
+        Coordinator of HTTP requests across the addon's processes, opened on
+        first use
+        :return:
+        """
+        if self._coordinator is None:
+            if not xbmcvfs.exists(self._addon_profile):
+                xbmcvfs.mkdirs(self._addon_profile)
+            self._coordinator = RequestCoordinator(
+                os.path.join(self._addon_profile, "requests.db")
+            )
+        return self._coordinator
+
+    def playing_fingerprint(self) -> Optional[str]:
+        """
+        Fingerprint of the video being played
+        :return: None if nothing is played or the file can not be read
+        """
+        __LOG_CATEGORY__ = "FINGERPRINT"
+
+        try:
+            player = xbmc.Player()
+            if not player.isPlayingVideo():
+                return None
+            return video_fingerprint(player.getPlayingFile())
+        except Exception as e:
+            self.log(
+                __LOG_CATEGORY__, f"Failed to fingerprint: {e}", level=xbmc.LOGWARNING
+            )
+            return None
+
+    def remembered_choice(self, fingerprint: Optional[str]) -> Optional[SubtitleChoice]:
+        """
+        Subtitle chosen before for the video being played, from the local history
+        :param fingerprint: fingerprint of the video being played
+        :return: None if there is none, or the history can not be read
+        """
+        __LOG_CATEGORY__ = "HISTORY"
+
+        if fingerprint is None:
+            return None
+        try:
+            return self.history().lookup(fingerprint)
+        except Exception as e:
+            self.log(
+                __LOG_CATEGORY__, f"Failed to read history: {e}", level=xbmc.LOGWARNING
+            )
+            return None
+
+    def forget_choice(self, fingerprint: Optional[str], item_id: str):
+        """
+        Drop the subtitle chosen before for the video being played
+        :param fingerprint: fingerprint of the video being played
+        :param item_id: the subtitle chosen before
+        :return:
+        """
+        __LOG_CATEGORY__ = "HISTORY"
+
+        if fingerprint is None:
+            return
+        self.log(__LOG_CATEGORY__, f"forgetting {item_id}", level=xbmc.LOGINFO)
+        try:
+            self.history().forget(fingerprint, item_id)
+        except Exception as e:
+            self.log(
+                __LOG_CATEGORY__, f"Failed to save history: {e}", level=xbmc.LOGWARNING
+            )
+
+    def apply_history(
+        self,
+        subtitles_list: List[SubtitleListItem],
+        choice: Optional[SubtitleChoice],
+        tvshow: str,
+    ) -> List[SubtitleListItem]:
+        """
+        Put the subtitle chosen before for this video first, and order the rest
+        by similarity with the subtitles chosen for other episodes of the show
+        :param subtitles_list: search results
+        :param choice: subtitle chosen before for the video being played
+        :param tvshow: tv show title of the video being played
+        :return:
+        """
+        __LOG_CATEGORY__ = "HISTORY"
+
+        if tvshow:
+            try:
+                chosen_names = self.history().recent_names(tvshow)
+            except Exception as e:
+                self.log(
+                    __LOG_CATEGORY__,
+                    f"Failed to read history: {e}",
+                    level=xbmc.LOGWARNING,
+                )
+            else:
+                subtitles_list = rank_by_history(
+                    subtitles_list, chosen_names, lambda x: x.name
+                )
+        if choice is not None:
+            self.log(__LOG_CATEGORY__, f"chosen before: {choice}")
+            subtitles_list = [SubtitleListItem.from_choice(choice)] + [
+                it for it in subtitles_list if it.item_id != choice.item_id
+            ]
+        return subtitles_list
+
     def search_handler(self, handle: int, item: SubtitleSearchInput):
         """
         UI Handler for Search action
@@ -169,35 +428,151 @@ class SubtitleAdapterBase(ABC):
 
         __LOG_CATEGORY__ = "SEARCH_HANDLER"
 
-        subtitles_list = self.search(item)
-        for it in subtitles_list:
-            listitem = it.getXmbcListItem()
-            paramstring = urllib.parse.urlencode(
-                {"action": "download", "item_id": it.item_id}
+        choice = self.remembered_choice(self.playing_fingerprint())
+        if choice is not None and not item.is_manual_search():
+            # a video played again gets the subtitle chosen before from the
+            # local history, without waiting for the site. A manual search
+            # still lists every result
+            self.log(__LOG_CATEGORY__, f"chosen before, not searching: {choice}")
+            subtitles_list = [SubtitleListItem.from_choice(choice)]
+            # searched by the download if the subtitle fails, for others to try
+            extra_params = "&" + urllib.parse.urlencode(
+                {
+                    "languages": ",".join(item.languages),
+                    "preferredlanguage": ",".join(item.preferredlanguage),
+                }
             )
-            url = f"plugin://{self._addon_id}/?{paramstring}"
-            xbmcplugin.addDirectoryItem(
-                handle=handle, url=url, listitem=listitem, isFolder=False
+        else:
+            extra_params = ""
+            try:
+                subtitles_list = self.search(item)
+            except SubtitleActionCancelled:
+                self.log(__LOG_CATEGORY__, "search cancelled", level=xbmc.LOGINFO)
+                xbmcplugin.endOfDirectory(handle, succeeded=False)
+                return
+            except Exception as e:
+                if choice is None:
+                    raise
+                self.log(
+                    __LOG_CATEGORY__,
+                    f"Failed to search, listing the subtitle chosen before: {e}",
+                    level=xbmc.LOGWARNING,
+                )
+                subtitles_list = []
+
+            subtitles_list = self.apply_history(
+                subtitles_list, choice, item.tvshow_title()
             )
+
+        # ListItems are only built here, and handed to Kodi in a single call
+        url_prefix = f"plugin://{self._addon_id}/?action=download&"
+        item_ids = [it.item_id for it in subtitles_list]
+        items = [
+            (
+                url_prefix
+                + it.url_params()
+                + "&fallback="
+                + urllib.parse.quote_plus(
+                    ",".join(item_ids[i + 1 : i + 1 + self.MAX_FALLBACKS])
+                )
+                + extra_params,
+                it.getXmbcListItem(),
+                False,
+            )
+            for i, it in enumerate(subtitles_list)
+        ]
+        xbmcplugin.addSortMethod(handle, xbmcplugin.SORT_METHOD_UNSORTED)
+        xbmcplugin.addDirectoryItems(handle, items, len(items))
         xbmcplugin.endOfDirectory(handle)
 
-    def download_handler(self, handle: int, item_id: str):
+    def download_handler(
+        self,
+        handle: int,
+        item_id: str,
+        item: Optional[SubtitleListItem] = None,
+        fallback: Sequence[str] = (),
+        search_item: Optional[SubtitleSearchInput] = None,
+    ):
         """
         UI Handler for Download action
         :param handle: a xmbc handle
         :param item_id: id for the download item
+        :param item: the search result being downloaded, remembered for the
+        video being played
+        :param fallback: ids of the next search results, tried in turn when the
+        item can not be downloaded or its file is invalid
+        :param search_item: search run for other results to try, when the item
+        was listed alone from the history and can not be used anymore
         :return:
         """
         __LOG_CATEGORY__ = "DOWNLOAD_HANDLER"
 
-        subtitle_file = self.download(item_id)
-        subtitle_path = self.load(subtitle_file, self._addon_temp)
+        fingerprint = self.playing_fingerprint()
+        choice = self.remembered_choice(fingerprint)
+
+        try:
+            candidate_id, subtitle_file, subtitle_path = self._download_first(
+                [item_id, *fallback], choice
+            )
+            if (
+                choice is not None
+                and choice.item_id == item_id
+                and candidate_id != item_id
+            ):
+                # gone from the site, or broken: stop offering it for the video
+                self.forget_choice(fingerprint, item_id)
+                if subtitle_path is None and search_item is not None:
+                    candidate_id, subtitle_file, subtitle_path = self._download_first(
+                        self._search_ids(search_item, exclude=[item_id]), None
+                    )
+        except SubtitleActionCancelled:
+            self.log(__LOG_CATEGORY__, "download cancelled", level=xbmc.LOGINFO)
+            xbmcplugin.endOfDirectory(handle, succeeded=False)
+            return
+
         if subtitle_path is None:
             self.log(
                 __LOG_CATEGORY__,
                 f"Failed to download file with item_id: {item_id}",
                 level=xbmc.LOGERROR,
             )
+        # only the result the user chose is remembered, the search results
+        # tried instead are only known by id
+        elif fingerprint is not None and item is not None and candidate_id == item_id:
+            member = (
+                os.path.basename(subtitle_path)
+                if subtitle_file.is_supported_archive_exts()
+                else None
+            )
+            try:
+                self.history().remember(
+                    fingerprint,
+                    xbmc.getInfoLabel("VideoPlayer.TVShowTitle"),
+                    SubtitleChoice(
+                        item_id=item_id,
+                        name=item.name,
+                        language_code=item.language_code,
+                        language_name=item.language_name,
+                        language_flag=item.language_flag,
+                        member=member,
+                    ),
+                )
+            except Exception as e:
+                self.log(
+                    __LOG_CATEGORY__,
+                    f"Failed to save history: {e}",
+                    level=xbmc.LOGWARNING,
+                )
+
+        if subtitle_path is not None:
+            subtitle_path = self.retime(
+                subtitle_path,
+                [
+                    os.path.basename(subtitle_path),
+                    subtitle_file.file_name,
+                    item.name if item is not None else "",
+                ],
+            )
 
         listitem = xbmcgui.ListItem(label=subtitle_path)
         xbmcplugin.addDirectoryItem(
@@ -206,11 +581,88 @@ class SubtitleAdapterBase(ABC):
 
         xbmcplugin.endOfDirectory(handle)
 
-    def load(self, file: SubtitleDownloadedFile, tmp_path: str) -> Optional[str]:
+    def _download_first(
+        self, candidate_ids: Sequence[str], choice: Optional[SubtitleChoice]
+    ) -> Tuple[Optional[str], Optional[SubtitleDownloadedFile], Optional[str]]:
+        """
+        Download the candidates in turn, until one holds a valid subtitle
+        :param candidate_ids: ids of the items to try
+        :param choice: subtitle chosen before for the video being played
+        :return: id and file of the item used, path of its subtitle; Nones if
+        none could be used
+        :raise SubtitleActionCancelled: if a download was cancelled
+        """
+        __LOG_CATEGORY__ = "DOWNLOAD_HANDLER"
+
+        for candidate_id in candidate_ids:
+            try:
+                subtitle_file = self.download(candidate_id)
+            except SubtitleActionCancelled:
+                raise
+            except Exception as e:
+                self.log(
+                    __LOG_CATEGORY__,
+                    f"Failed to download {candidate_id}: {e}",
+                    level=xbmc.LOGERROR,
+                )
+                continue
+
+            preferred_member = (
+                choice.member
+                if choice is not None and choice.item_id == candidate_id
+                else None
+            )
+            subtitle_path = self.load(subtitle_file, self._addon_temp, preferred_member)
+            if subtitle_path is not None:
+                return candidate_id, subtitle_file, subtitle_path
+            self.log(
+                __LOG_CATEGORY__,
+                f"No subtitle in {candidate_id}, trying the next result",
+                level=xbmc.LOGWARNING,
+            )
+        return None, None, None
+
+    def _search_ids(
+        self, search_item: SubtitleSearchInput, exclude: Sequence[str]
+    ) -> List[str]:
+        """
+        :return: ids of the first search results, up to MAX_FALLBACKS, [] if
+        the search failed
+        :raise SubtitleActionCancelled: if the search was cancelled
+        """
+        __LOG_CATEGORY__ = "DOWNLOAD_HANDLER"
+
+        try:
+            results = self.search(search_item)
+        except SubtitleActionCancelled:
+            raise
+        except Exception as e:
+            self.log(__LOG_CATEGORY__, f"Failed to search: {e}", level=xbmc.LOGWARNING)
+            return []
+        item_ids = [it.item_id for it in results if it.item_id not in exclude]
+        return item_ids[: self.MAX_FALLBACKS]
+
+    def load(
+        self,
+        file: SubtitleDownloadedFile,
+        tmp_path: str,
+        preferred_member: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Save a downloaded file, and pick the subtitle to use from it
+        :param file: SubtitleDownloadedFile
+        :param tmp_path: where to save the file
+        :param preferred_member: file name of the archive member chosen before,
+        picked without asking the user if the archive has it
+        :return: path of the subtitle, None if there is none
+        """
         __LOG_CATEGORY__ = "LOAD"
 
-        if not file.is_valid():
-            self.log(__LOG_CATEGORY__, f"Invalid file: {file}", level=xbmc.LOGERROR)
+        error = file.validation_error()
+        if error is not None:
+            self.log(
+                __LOG_CATEGORY__, f"Invalid file: {file}, {error}", level=xbmc.LOGERROR
+            )
             return None
 
         store_path = self.save_file(file, tmp_path)
@@ -230,6 +682,11 @@ class SubtitleAdapterBase(ABC):
             if len(list_sub_files) == 1:
                 return list_sub_files[0][1]
             elif len(list_sub_files) > 1:
+                for _, sub_path in list_sub_files:
+                    if os.path.basename(sub_path) == preferred_member:
+                        self.log(__LOG_CATEGORY__, f"chosen before: {sub_path}")
+                        return sub_path
+
                 dlist = [x[0] for x in list_sub_files]
 
                 self.log(
@@ -252,6 +709,64 @@ class SubtitleAdapterBase(ABC):
 
         return None
 
+    def retime(self, subtitle_path: str, names: Sequence[str]) -> str:
+        """
+        Retime a subtitle made for a release of another frame rate than the
+        video being played, e.g. a 25fps PAL release for a 23.976fps video,
+        unless the auto_retime setting is off
+        :param subtitle_path: path of the subtitle, can be in an archive
+        :param names: names the subtitle came with, the first naming a frame
+        rate wins
+        :return: path of the retimed copy in the temp dir, subtitle_path if the
+        subtitle needs no retiming or can not be retimed
+        """
+        __LOG_CATEGORY__ = "RETIME"
+
+        _, extension = os.path.splitext(subtitle_path)
+        if extension.lower() not in RETIMED_EXTS:
+            return subtitle_path
+        # names can be wrong, let the user turn it off
+        if not xbmcaddon.Addon(self._addon_id).getSettingBool("auto_retime"):
+            return subtitle_path
+
+        video_fps = snap_fps(xbmc.getInfoLabel("Player.Process(VideoFPS)"))
+        subtitle_fps = next(filter(None, map(fps_from_name, names)), None)
+        if video_fps is None or subtitle_fps is None:
+            return subtitle_path
+
+        retiming = Retiming.from_fps(subtitle_fps, video_fps)
+        if retiming.is_identity():
+            return subtitle_path
+
+        try:
+            sub_file = xbmcvfs.File(subtitle_path)
+            try:
+                content = bytes(sub_file.readBytes())
+            finally:
+                sub_file.close()
+
+            retimed_path = os.path.join(
+                self._addon_temp,
+                f"sub_{datetime.datetime.now().isoformat()}{extension}",
+            )
+            with open(retimed_path, "wb") as retimed_file:
+                retimed_file.write(retime(extension, content, retiming))
+        except Exception as e:
+            self.log(
+                __LOG_CATEGORY__,
+                f"Failed to retime {subtitle_path}: {e}",
+                level=xbmc.LOGWARNING,
+            )
+            return subtitle_path
+
+        self.log(
+            __LOG_CATEGORY__,
+            f"{subtitle_path} retimed from {subtitle_fps:.3f}fps to "
+            f"{video_fps:.3f}fps: {retimed_path}",
+            level=xbmc.LOGINFO,
+        )
+        return retimed_path
+
     def save_file(self, sub_file: SubtitleDownloadedFile, base_path) -> str:
         """
         Save SubtitleDownloadFile to local file system
@@ -358,7 +873,22 @@ class SubtitleAdapterBase(ABC):
             )
 
         elif action == "download":
-            self.download_handler(handle, params["item_id"])
+            search_item = (
+                SubtitleSearchInput(
+                    params["languages"].split(","),
+                    params.get("preferredlanguage", "").split(","),
+                    None,
+                )
+                if "languages" in params
+                else None
+            )
+            self.download_handler(
+                handle,
+                params["item_id"],
+                SubtitleListItem.from_params(params),
+                [x for x in params.get("fallback", "").split(",") if x],
+                search_item,
+            )
         else:
             self.log(__LOG_CATEGORY__, f" unknow action: {action}", level=xbmc.LOGERROR)
 
@@ -373,3 +903,91 @@ class SubtitleAdapterBase(ABC):
                 url_query = url_query[0:-1]
 
         return dict(parse.parse_qsl(url_query))
+
+
+class AsyncSubtitleAdapterBase(SubtitleAdapterBase):
+    """
+    Adapter whose search/download are coroutines.
+
+    Blocking work (HTTP, parsing) is offloaded with run_blocking, so several
+    fetches of one action can overlap (e.g. with asyncio.gather). The action
+    is abandoned as soon as its CancellationToken is cancelled: the coroutine
+    is cancelled and SubtitleActionCancelled is raised right away. Blocking
+    work still running is left to daemon threads, and should stop soon by
+    itself by checking the token, as Kodi waits for it before tearing down the
+    plugin. Only the token is action scoped: adapter state, e.g. an HTTP
+    session, may be in use by other actions.
+    """
+
+    POLL_INTERVAL: ClassVar[float] = 0.1
+    MAX_WORKERS: ClassVar[int] = 4
+
+    @abstractmethod
+    async def search_async(
+        self, item: SubtitleSearchInput, token: CancellationToken
+    ) -> List[SubtitleListItem]:
+        """
+
+        :param item: SubtitleSearchIterm
+        :param token: CancellationToken of the action
+        :return: List search result
+        """
+        pass
+
+    @abstractmethod
+    async def download_async(
+        self, item_id: str, token: CancellationToken
+    ) -> SubtitleDownloadedFile:
+        """
+
+        :param item_id: id of the item to be downloaded
+        :param token: CancellationToken of the action
+        :return:
+        """
+        pass
+
+    def search(self, item: SubtitleSearchInput) -> List[SubtitleListItem]:
+        return self.run(self.search_async, item)
+
+    def download(self, item_id: str) -> SubtitleDownloadedFile:
+        return self.run(self.download_async, item_id)
+
+    async def run_blocking(self, func: Callable, *args) -> Any:
+        """
+        Run a blocking function in the executor of the current action
+        :param func: blocking function
+        :param args: arguments of func
+        :return: result of func
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            _action_executor.get(), func, *args
+        )
+
+    def run(
+        self, coro_func: Callable, *args, token: Optional[CancellationToken] = None
+    ):
+        """
+        Run an action coroutine to completion, unless it gets cancelled
+        :param coro_func: coroutine function, called with (*args, token)
+        :param args: arguments of the action
+        :param token: CancellationToken, a new one is created by default
+        :return: result of the action
+        :raise SubtitleActionCancelled: if the action was cancelled
+        """
+        __LOG_CATEGORY__ = "RUN"
+
+        token = token or CancellationToken()
+        executor = DaemonThreadExecutor(max_workers=self.MAX_WORKERS)
+
+        async def run_cancellable():
+            _action_executor.set(executor)
+            task = asyncio.ensure_future(coro_func(*args, token))
+            while not task.done():
+                if token.is_cancelled():
+                    task.cancel()
+                    self.log(__LOG_CATEGORY__, f"{coro_func.__name__} cancelled")
+                    raise SubtitleActionCancelled()
+                await asyncio.wait([task], timeout=self.POLL_INTERVAL)
+            return task.result()
+
+        return asyncio.run(run_cancellable())
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import contextlib
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+FetchResult = Tuple[bytes, Dict[str, str]]
+
+
+class RequestCancelled(Exception):
+    """
+    The request was given up, while waiting for another process or the rate
+    limit, or while being fetched
+    """
+
+
+class RequestCoordinator:
+    """
+    Coordinates the HTTP requests of all the addon's processes (plugin calls
+    running at the same time, the resident worker) through a sqlite db in the
+    addon profile:
+
+    - single-flight: identical requests in flight are fetched once, by the
+      first process asking (the leader); the others wait for its result,
+      which is kept for a short ttl. If the leader fails or its process is
+      gone, the next waiting process takes over.
+    - rate limit: requests to a host draw from a token bucket shared by all
+      processes.
+    """
+
+    RATE: float = 2.0  # requests per second, per host
+    BURST: float = 4.0
+    # a leader not done after this is considered dead, even if its process is
+    # alive: in Kodi, every plugin call and the worker share Kodi's process
+    LEASE: float = 45.0
+    RESULT_TTL: float = 60.0
+    POLL_INTERVAL: float = 0.05
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._owner = uuid.uuid4().hex
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS flights (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    started REAL NOT NULL,
+                    done INTEGER NOT NULL,
+                    expires REAL NOT NULL,
+                    body BLOB,
+                    headers TEXT
+                )
+                """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    host TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+                """)
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connect()
+        try:
+            # take the write lock upfront, so check-then-write is atomic
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._db_path, timeout=10, isolation_level=None)
+
+    def _flight(self, conn: sqlite3.Connection, key: str) -> Optional[tuple]:
+        return conn.execute(
+            "SELECT pid, started, done, expires, body, headers"
+            " FROM flights WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+    def _abandoned(self, row: tuple, now: float) -> bool:
+        """
+        :return: True if the flight of row is done and expired, or its leader
+        is gone
+        """
+        pid, started, done, expires = row[:4]
+        if done:
+            return expires <= now
+        return started + self.LEASE <= now or not _process_alive(pid)
+
+    def fetch(
+        self,
+        key: str,
+        host: Optional[str],
+        fetch: Callable[[], FetchResult],
+        ttl: float = RESULT_TTL,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> FetchResult:
+        """
+        Fetch once across processes
+        :param key: identity of the request, e.g. its url
+        :param host: host the request goes to, for rate limiting; None if fetch
+        rate limits itself with acquire()
+        :param fetch: does the request, returns body and headers
+        :param ttl: how long the result is served to other requests
+        :param cancelled: polled while waiting for the leader, stop waiting once
+        it returns True
+        :return: body and headers
+        :raise RequestCancelled: if cancelled before the result was available
+        """
+        while True:
+            # followers poll with plain reads, only claiming takes the write lock
+            conn = self._connect()
+            try:
+                row = self._flight(conn, key)
+            finally:
+                conn.close()
+            now = time.time()
+            if row is not None and not self._abandoned(row, now):
+                if row[2]:
+                    return row[4], json.loads(row[5])
+                self._sleep(self.POLL_INTERVAL, cancelled)
+                continue
+            with self._transaction() as conn:
+                # another process may have claimed it since the read
+                row = self._flight(conn, key)
+                if row is None or self._abandoned(row, now):
+                    conn.execute(
+                        "DELETE FROM flights WHERE done = 1 AND expires <= ?", (now,)
+                    )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO flights"
+                        " VALUES (?, ?, ?, ?, 0, 0, NULL, NULL)",
+                        (key, self._owner, os.getpid(), now),
+                    )
+                    break
+
+        try:
+            if host is not None:
+                self.acquire(host, cancelled)
+            body, headers = fetch()
+        except BaseException:
+            with self._transaction() as conn:
+                conn.execute(
+                    "DELETE FROM flights WHERE key = ? AND owner = ?",
+                    (key, self._owner),
+                )
+            raise
+
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE flights SET done = 1, expires = ?, body = ?, headers = ?"
+                " WHERE key = ? AND owner = ?",
+                (time.time() + ttl, body, json.dumps(headers), key, self._owner),
+            )
+        return body, headers
+
+    def acquire(self, host: str, cancelled: Optional[Callable[[], bool]] = None):
+        """
+        Block until the host's token bucket allows one more request
+        :param host: host the request goes to
+        :param cancelled: polled while waiting, stop waiting once it returns True
+        :return:
+        :raise RequestCancelled: if cancelled before the request was allowed
+        """
+        while True:
+            now = time.time()
+            with self._transaction() as conn:
+                row = conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE host = ?", (host,)
+                ).fetchone()
+                tokens = (
+                    self.BURST
+                    if row is None
+                    else min(self.BURST, row[0] + (now - row[1]) * self.RATE)
+                )
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / self.RATE
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                    (host, tokens - 1 if wait == 0 else tokens, now),
+                )
+            if wait == 0:
+                return
+            self._sleep(wait, cancelled)
+
+    def _sleep(self, seconds: float, cancelled: Optional[Callable[[], bool]]):
+        if cancelled is None:
+            time.sleep(seconds)
+            return
+        deadline = time.monotonic() + seconds
+        while True:
+            if cancelled():
+                raise RequestCancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, self.POLL_INTERVAL))
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            # ERROR_ACCESS_DENIED: it exists, but belongs to another user
+            return kernel32.GetLastError() == 5
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            # STILL_ACTIVE
+            return exit_code.value == 259
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # it exists, but belongs to another user
+        pass
+    return True
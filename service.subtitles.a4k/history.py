@@ -0,0 +1,155 @@
+import re
+import time
+import sqlite3
+import hashlib
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, TypeVar
+
+import xbmcvfs
+
+T = TypeVar("T")
+
+FINGERPRINT_CHUNK_SIZE: int = 64 * 1024
+
+
+def video_fingerprint(path: str) -> Optional[str]:
+    """
+    Fingerprint a video file from its size and its first and last chunks,
+    read through xbmcvfs, so the file is never read in full
+    :param path: path or url of the video file
+    :return: hex digest, None if the file can not be fingerprinted (e.g. streams)
+    """
+    if not path:
+        return None
+
+    video_file = xbmcvfs.File(path)
+    try:
+        size = video_file.size()
+        if size <= 0:
+            return None
+        md5 = hashlib.md5(str(size).encode())
+        md5.update(bytes(video_file.readBytes(FINGERPRINT_CHUNK_SIZE)))
+        if size > FINGERPRINT_CHUNK_SIZE:
+            video_file.seek(size - FINGERPRINT_CHUNK_SIZE, 0)
+            md5.update(bytes(video_file.readBytes(FINGERPRINT_CHUNK_SIZE)))
+        return md5.hexdigest()
+    finally:
+        video_file.close()
+
+
+def _tokens(name: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", name.lower()))
+
+
+def rank_by_history(
+    results: Sequence[T], chosen_names: List[str], name: Callable[[T], str]
+) -> List[T]:
+    """
+    Order results by how many name tokens (release group, resolution, source...)
+    they share with subtitles chosen before, keeping the original order on ties
+    :param results: search results
+    :param chosen_names: names of subtitles chosen before, e.g. for other episodes
+    :param name: returns the name of a result
+    :return: reordered results
+    """
+    if not chosen_names:
+        return list(results)
+    chosen = set().union(*(_tokens(x) for x in chosen_names))
+    return sorted(results, key=lambda it: -len(_tokens(name(it)) & chosen))
+
+
+@dataclass
+class SubtitleChoice:
+    item_id: str
+    name: str
+    language_code: str
+    language_name: str
+    language_flag: str
+    member: Optional[str]
+
+
+class SubtitleHistory:
+    """
+    Subtitles the user chose, by fingerprint of the video they were played with
+    """
+
+    RECENT_LIMIT: int = 5
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS choices (
+                    fingerprint TEXT PRIMARY KEY,
+                    tvshow TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    language_code TEXT NOT NULL,
+                    language_name TEXT NOT NULL,
+                    language_flag TEXT NOT NULL,
+                    member TEXT,
+                    updated REAL NOT NULL
+                )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS choices_tvshow ON choices (tvshow, updated)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._db_path, timeout=5)
+
+    def remember(self, fingerprint: str, tvshow: str, choice: SubtitleChoice):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO choices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    fingerprint,
+                    tvshow,
+                    choice.item_id,
+                    choice.name,
+                    choice.language_code,
+                    choice.language_name,
+                    choice.language_flag,
+                    choice.member,
+                    time.time(),
+                ),
+            )
+
+    def forget(self, fingerprint: str, item_id: str):
+        """
+        Drop the subtitle chosen for a video, e.g. when it can not be downloaded
+        anymore
+        :param fingerprint: fingerprint of the video
+        :param item_id: the subtitle chosen, left alone if another was chosen since
+        :return:
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM choices WHERE fingerprint = ? AND item_id = ?",
+                (fingerprint, item_id),
+            )
+
+    def lookup(self, fingerprint: str) -> Optional[SubtitleChoice]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT item_id, name, language_code, language_name, language_flag,"
+                " member FROM choices WHERE fingerprint = ?",
+                (fingerprint,),
+            ).fetchone()
+        return SubtitleChoice(*row) if row else None
+
+    def recent_names(self, tvshow: str) -> List[str]:
+        """
+        Names of the subtitles chosen last for episodes of a tv show
+        :param tvshow: tv show title
+        :return:
+        """
+        if not tvshow:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT name FROM choices WHERE tvshow = ?"
+                " ORDER BY updated DESC LIMIT ?",
+                (tvshow, self.RECENT_LIMIT),
+            ).fetchall()
+        return [row[0] for row in rows]
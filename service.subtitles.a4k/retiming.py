@@ -0,0 +1,220 @@
+import re
+import codecs
+from array import array
+from dataclasses import dataclass
+from typing import ClassVar, Dict, Optional, Tuple
+
+# standard frame rates, NTSC ones at their exact value
+FPS: Dict[str, float] = {
+    "23.976": 24000 / 1001,
+    "23.98": 24000 / 1001,
+    "24": 24.0,
+    "25": 25.0,
+    "29.97": 30000 / 1001,
+    "30": 30.0,
+    "50": 50.0,
+    "59.94": 60000 / 1001,
+    "60": 60.0,
+}
+# a frame rate in a release name, e.g. "Movie.25fps.srt" or "Movie.23.976.srt"
+_NAME_FPS = re.compile(
+    r"(?<!\d)(?<!\d\.)(?:(23\.976|23\.98|29\.97|59\.94|24|25|30|50|60)\s*fps"
+    r"|(23\.976|29\.97|59\.94)(?!\.?\d))",
+    re.IGNORECASE,
+)
+# only the uppercase release token, "Pal" is a word of titles
+_NAME_PAL = re.compile(r"(?<![A-Za-z])PAL(?![A-Za-z])")
+
+
+@dataclass(frozen=True)
+class _Format:
+    # a cue: the text leading its start time, the start time, the separator and
+    # the end time, so that re.split puts each at a fixed stride
+    cue: "re.Pattern[bytes]"
+    fraction_digits: int
+    template: bytes
+
+
+_FORMATS: Dict[str, _Format] = {
+    ".srt": _Format(
+        re.compile(
+            rb"^([ \t]*)(\d{1,2}:\d{2}:\d{2}[,.]\d{3})"
+            rb"([ \t]*-->[ \t]*)(\d{1,2}:\d{2}:\d{2}[,.]\d{3})",
+            re.MULTILINE,
+        ),
+        3,
+        b"%02d:%02d:%02d,%03d",
+    ),
+    ".ass": _Format(
+        re.compile(
+            rb"^((?:Dialogue|Comment):[^,\n]*,)"
+            rb"(\d:\d{2}:\d{2}\.\d{2})(,)(\d:\d{2}:\d{2}\.\d{2})",
+            re.MULTILINE,
+        ),
+        2,
+        b"%d:%02d:%02d.%02d",
+    ),
+}
+_FORMATS[".ssa"] = _FORMATS[".ass"]
+_STRIDE = 5  # 4 groups of the cue pattern, and the text between cues
+_START, _END = 2, 4  # index of the first start and end time in re.split parts
+
+RETIMED_EXTS = tuple(_FORMATS)
+
+
+def snap_fps(value: str) -> Optional[float]:
+    """
+    :param value: frame rate as reported, e.g. "23.976" or "23.98"
+    :return: the standard frame rate closest to value, None if there is none
+    """
+    try:
+        fps = float(value)
+    except (TypeError, ValueError):
+        return None
+    closest = min(FPS.values(), key=lambda x: abs(x - fps))
+    return closest if abs(closest - fps) < 0.01 else None
+
+
+def fps_from_name(name: str) -> Optional[float]:
+    """
+    :param name: name of a subtitle, as found in search results or archives
+    :return: the frame rate the subtitle is timed for, None if it does not say
+    """
+    match = _NAME_FPS.search(name or "")
+    if match:
+        return FPS[match.group(1) or match.group(2)]
+    return FPS["25"] if _NAME_PAL.search(name or "") else None
+
+
+@dataclass(frozen=True)
+class Retiming:
+    """
+    Linear map of subtitle times to video times: video = subtitle * scale + offset,
+    in milliseconds
+    """
+
+    scale: float = 1.0
+    offset: float = 0.0
+
+    # below this, the drift stays under 1.5s over a 2h movie
+    TOLERANCE: ClassVar[float] = 0.0002
+
+    @classmethod
+    def from_fps(cls, subtitle_fps: float, video_fps: float) -> "Retiming":
+        """
+        :param subtitle_fps: frame rate of the release the subtitle was timed for
+        :param video_fps: frame rate of the video being played
+        """
+        return cls(scale=subtitle_fps / video_fps)
+
+    @classmethod
+    def from_offset(cls, offset: float) -> "Retiming":
+        """
+        :param offset: milliseconds added to every time, negative to show earlier
+        """
+        return cls(offset=offset)
+
+    @classmethod
+    def from_points(
+        cls, first: Tuple[float, float], second: Tuple[float, float]
+    ) -> "Retiming":
+        """
+        Fit the map to two cues whose video times are known, e.g. the first and
+        the last line of the movie
+        :param first: subtitle time and video time of a cue, in milliseconds
+        :param second: the same for another cue
+        """
+        (subtitle_1, video_1), (subtitle_2, video_2) = first, second
+        if subtitle_1 == subtitle_2:
+            raise ValueError("the two points need different subtitle times")
+        scale = (video_2 - video_1) / (subtitle_2 - subtitle_1)
+        return cls(scale=scale, offset=video_1 - subtitle_1 * scale)
+
+    def is_identity(self) -> bool:
+        return abs(self.scale - 1) < self.TOLERANCE and abs(self.offset) < 1
+
+    def apply(self, times: array) -> array:
+        """
+        :param times: times in milliseconds
+        :return: the mapped times, rounded to milliseconds, never negative
+        """
+        scale, offset = self.scale, self.offset
+        mapped = array("d", [round(t * scale + offset) for t in times])
+        if offset < 0:
+            mapped = array("d", [t if t > 0 else 0 for t in mapped])
+        return mapped
+
+
+def parse_times(extension: str, content: bytes) -> array:
+    """
+    :param extension: .srt, .ass or .ssa
+    :param content: subtitle file, in an ASCII compatible encoding
+    :return: start times of every cue, then their end times, in milliseconds
+    """
+    subtitle_format = _FORMATS[extension.lower()]
+    return _parse(subtitle_format, subtitle_format.cue.split(content))
+
+
+def _parse(subtitle_format: _Format, parts: list) -> array:
+    # without separators, a timestamp is one number: HHMMSSfff for srt, HMMSScc
+    # for ass. Joining them all lets int() run over the lot without slicing
+    digits = b" ".join(parts[_START::_STRIDE] + parts[_END::_STRIDE])
+    digits = digits.translate(None, b":,.")
+    fraction = 10**subtitle_format.fraction_digits
+    seconds, minutes, hours = fraction, fraction * 100, fraction * 10_000
+    fraction_scale = 1000 // fraction
+    return array(
+        "d",
+        [
+            n // hours * 3_600_000
+            + n // minutes % 100 * 60_000
+            + n // seconds % 100 * 1000
+            + n % fraction * fraction_scale
+            for n in map(int, digits.split())
+        ],
+    )
+
+
+def _format(subtitle_format: _Format, parts: list, times: array):
+    fraction_scale = 1000 // 10**subtitle_format.fraction_digits
+    template = subtitle_format.template
+    formatted = [
+        template
+        % (t // 3_600_000, t // 60_000 % 60, t // 1000 % 60, t % 1000 // fraction_scale)
+        for t in map(int, times)
+    ]
+    cues = len(formatted) // 2
+    parts[_START::_STRIDE] = formatted[:cues]
+    parts[_END::_STRIDE] = formatted[cues:]
+
+
+def retime(extension: str, content: bytes, retiming: Retiming) -> bytes:
+    """
+    Retime every cue of a subtitle file in one pass: all the timestamps are
+    parsed into one array, mapped, and written back in place
+    :param extension: .srt, .ass or .ssa
+    :param content: subtitle file
+    :param retiming: map to apply
+    :return: the retimed file, in the encoding of content
+    """
+    extension = extension.lower()
+    encoding = None
+    for bom, codec in (
+        (codecs.BOM_UTF16_LE, "utf-16-le"),
+        (codecs.BOM_UTF16_BE, "utf-16-be"),
+    ):
+        if content.startswith(bom):
+            # timestamps are matched as ASCII bytes
+            encoding = codec
+            content = content[len(bom) :].decode(codec).encode("utf-8")
+
+    subtitle_format = _FORMATS[extension]
+    parts = subtitle_format.cue.split(content)
+    if len(parts) > 1:
+        _format(subtitle_format, parts, retiming.apply(_parse(subtitle_format, parts)))
+    content = b"".join(parts)
+
+    if encoding is not None:
+        bom = codecs.BOM_UTF16_LE if encoding == "utf-16-le" else codecs.BOM_UTF16_BE
+        content = bom + content.decode("utf-8").encode(encoding)
+    return content
@@ -1,7 +1,18 @@
 import os
 import sys
 
-from adapter import A4KAdapter
+import xbmcaddon
 
-sa = A4KAdapter()
+from worker import RemoteAdapter, WorkerClient
+
+
+def local_adapter():
+    # only imported when the resident worker is down, as it pulls in bs4/requests
+    from adapter import A4KAdapter
+
+    return A4KAdapter()
+
+
+addon = xbmcaddon.Addon()
+sa = RemoteAdapter(addon, WorkerClient.for_addon(addon), local_adapter)
 sa.router(int(sys.argv[1]), sys.argv[2])
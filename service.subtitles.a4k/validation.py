@@ -0,0 +1,260 @@
+import io
+import re
+import zlib
+import codecs
+import struct
+import zipfile
+from typing import Callable, Dict, Optional, Union
+
+# text formats are checked on this much of the file, and the whole file is
+# never decoded: an HTML error page or a binary blob shows in the first bytes
+PREFIX_SIZE: int = 64 * 1024
+CRC_CHUNK_SIZE: int = 16 * 1024
+
+SUBTITLE_EXTS = (".srt", ".sub", ".smi", ".ssa", ".ass", ".sup")
+
+_HTML = re.compile(rb"\s*<(!doctype\s+html|html|head|body)\b", re.IGNORECASE)
+_SRT_CUE = re.compile(
+    rb"\d{1,2}:\d{1,2}:\d{1,2}[,.:]\d{1,3}[ \t]*-->[ \t]*\d{1,2}:\d{1,2}:\d{1,2}[,.:]\d{1,3}"
+)
+_ASS_HEADER = re.compile(rb"\s*\[script info\]", re.IGNORECASE)
+_MICRODVD_CUE = re.compile(rb"^\s*\{\d+\}\{\d*\}", re.MULTILINE)
+_SUBVIEWER_CUE = re.compile(rb"\d{2}:\d{2}:\d{2}\.\d{2},\d{2}:\d{2}:\d{2}\.\d{2}")
+_SAMI = re.compile(rb"<sami\b", re.IGNORECASE)
+_SAMI_SYNC = re.compile(rb"<sync\b", re.IGNORECASE)
+
+VOBSUB_MAGIC = b"\x00\x00\x01\xba"
+PGS_MAGIC = b"PG"
+PGS_SEGMENT = struct.Struct(">2sIIBH")  # magic, pts, dts, type, size
+PGS_SEGMENT_TYPES = (0x14, 0x15, 0x16, 0x17, 0x80)
+RAR_MAGICS = (b"Rar!\x1a\x07\x00", b"Rar!\x1a\x07\x01\x00")
+SEVEN_ZIP_MAGIC = b"7z\xbc\xaf\x27\x1c"
+SEVEN_ZIP_START_HEADER = struct.Struct("<6s2sIQQI")
+XZ_MAGIC = b"\xfd7zXZ\x00"
+XZ_FOOTER_MAGIC = b"YZ"
+
+
+def _encoding(content: bytes) -> Optional[str]:
+    """
+    :return: the UTF-16 codec if the content starts with its BOM, None for
+    ASCII compatible encodings (UTF-8, GBK, Big5...), which are checked as bytes
+    """
+    if content.startswith(codecs.BOM_UTF16_LE):
+        return "utf-16-le"
+    if content.startswith(codecs.BOM_UTF16_BE):
+        return "utf-16-be"
+    return None
+
+
+def _text_prefix(content: bytes) -> Optional[Union[bytes, memoryview]]:
+    """
+    :return: the start of a text file as ASCII compatible bytes, None if it
+    looks binary
+    """
+    encoding = _encoding(content)
+    if encoding is None:
+        start = len(codecs.BOM_UTF8) if content.startswith(codecs.BOM_UTF8) else 0
+        end = min(len(content), PREFIX_SIZE)
+        if content.find(b"\x00", start, end) != -1:
+            return None
+        # a view, the prefix is not copied
+        return memoryview(content)[start:end]
+    prefix = content[2 : PREFIX_SIZE - PREFIX_SIZE % 2]
+    return prefix.decode(encoding, errors="replace").encode("utf-8")
+
+
+def _contains(content: bytes, needle: bytes) -> bool:
+    encoding = _encoding(content)
+    if encoding is not None:
+        needle = needle.decode("ascii").encode(encoding)
+    return needle in content
+
+
+def _text_check(check: Callable[[bytes, bytes], Optional[str]]):
+    def wrapper(content: bytes) -> Optional[str]:
+        prefix = _text_prefix(content)
+        if prefix is None:
+            return "binary content"
+        if _HTML.match(prefix):
+            return "html page"
+        return check(content, prefix)
+
+    return wrapper
+
+
+@_text_check
+def _check_srt(content: bytes, prefix: bytes) -> Optional[str]:
+    return None if _SRT_CUE.search(prefix) else "no srt cue"
+
+
+@_text_check
+def _check_ass(content: bytes, prefix: bytes) -> Optional[str]:
+    if not _ASS_HEADER.match(prefix):
+        return "no [Script Info] header"
+    # embedded fonts can push the events far from the start
+    if not _contains(content, b"[Events]"):
+        return "no [Events] section"
+    if not _contains(content, b"Dialogue:"):
+        return "no dialogue"
+    return None
+
+
+@_text_check
+def _check_smi(content: bytes, prefix: bytes) -> Optional[str]:
+    if not _SAMI.search(prefix):
+        return "no <SAMI> element"
+    return None if _SAMI_SYNC.search(prefix) else "no <SYNC> element"
+
+
+@_text_check
+def _check_sub_text(content: bytes, prefix: bytes) -> Optional[str]:
+    if _MICRODVD_CUE.search(prefix) or _SUBVIEWER_CUE.search(prefix):
+        return None
+    return "no MicroDVD or SubViewer cue"
+
+
+def _check_sub(content: bytes) -> Optional[str]:
+    # .sub is either MicroDVD/SubViewer text, or the binary half of VobSub
+    if content.startswith(VOBSUB_MAGIC):
+        return None
+    return _check_sub_text(content)
+
+
+def _check_sup(content: bytes) -> Optional[str]:
+    # walk the PGS segment headers, which must chain to the end of the file
+    offset = 0
+    end = len(content)
+    while offset < end:
+        if end - offset < PGS_SEGMENT.size:
+            return f"truncated segment at {offset}"
+        magic, _, _, segment_type, size = PGS_SEGMENT.unpack_from(content, offset)
+        if magic != PGS_MAGIC or segment_type not in PGS_SEGMENT_TYPES:
+            return f"invalid segment at {offset}"
+        offset += PGS_SEGMENT.size + size
+    return None if offset == end else "truncated segment"
+
+
+def _check_zip(content: bytes) -> Optional[str]:
+    try:
+        # parses the end of central directory record and the central directory
+        archive = zipfile.ZipFile(io.BytesIO(content))
+    except (zipfile.BadZipFile, OSError, ValueError) as e:
+        return f"bad zip: {e}"
+
+    with archive:
+        members = [
+            info
+            for info in archive.infolist()
+            if info.filename.lower().endswith(SUBTITLE_EXTS) and not info.is_dir()
+        ]
+        if not members:
+            return "no subtitle in zip"
+        # only subtitles are extracted, so only their CRCs matter
+        for info in members:
+            try:
+                # checks the local header, and the CRC once fully read
+                with archive.open(info) as member:
+                    while member.read(CRC_CHUNK_SIZE):
+                        pass
+            except NotImplementedError:
+                # compression zipfile can not read, leave it to Kodi
+                continue
+            except (
+                zipfile.BadZipFile,
+                RuntimeError,
+                OSError,
+                EOFError,
+                zlib.error,
+            ) as e:
+                return f"bad zip member {info.filename}: {e}"
+    return None
+
+
+def _check_rar(content: bytes) -> Optional[str]:
+    return None if content.startswith(RAR_MAGICS) else "not a rar archive"
+
+
+def _check_7z(content: bytes) -> Optional[str]:
+    if len(content) < SEVEN_ZIP_START_HEADER.size:
+        return "not a 7z archive"
+    (
+        magic,
+        _,
+        start_header_crc,
+        next_header_offset,
+        next_header_size,
+        next_header_crc,
+    ) = SEVEN_ZIP_START_HEADER.unpack_from(content)
+    if magic != SEVEN_ZIP_MAGIC:
+        return "not a 7z archive"
+    if zlib.crc32(content[12:32]) != start_header_crc:
+        return "bad 7z start header"
+    # the header listing the files comes last, so truncation cuts it off
+    start = SEVEN_ZIP_START_HEADER.size + next_header_offset
+    if start + next_header_size > len(content):
+        return "truncated 7z archive"
+    if zlib.crc32(content[start : start + next_header_size]) != next_header_crc:
+        return "bad 7z header"
+    return None
+
+
+def _check_gz(content: bytes) -> Optional[str]:
+    # magic, method, flags, mtime, xfl, os, crc32, isize
+    if len(content) < 18 or not content.startswith(b"\x1f\x8b\x08"):
+        return "not a gzip file"
+    return None
+
+
+def _check_bz2(content: bytes) -> Optional[str]:
+    if not re.match(rb"BZh[1-9]", content[:4]):
+        return "not a bzip2 file"
+    return None
+
+
+def _check_xz(content: bytes) -> Optional[str]:
+    if not content.startswith(XZ_MAGIC):
+        return "not a xz file"
+    return None if content.endswith(XZ_FOOTER_MAGIC) else "truncated xz file"
+
+
+def _check_tar(content: bytes) -> Optional[str]:
+    return None if content[257:262] == b"ustar" else "not a tar archive"
+
+
+def _check_iso(content: bytes) -> Optional[str]:
+    return None if content[0x8001:0x8006] == b"CD001" else "not an iso image"
+
+
+CHECKS: Dict[str, Callable[[bytes], Optional[str]]] = {
+    ".srt": _check_srt,
+    ".ass": _check_ass,
+    ".ssa": _check_ass,
+    ".smi": _check_smi,
+    ".sub": _check_sub,
+    ".sup": _check_sup,
+    ".zip": _check_zip,
+    ".rar": _check_rar,
+    ".cbr": _check_rar,
+    ".7z": _check_7z,
+    ".gz": _check_gz,
+    ".tgz": _check_gz,
+    ".bz2": _check_bz2,
+    ".tbz2": _check_bz2,
+    ".xz": _check_xz,
+    ".tar": _check_tar,
+    ".iso": _check_iso,
+}
+
+
+def validate(extension: str, content: bytes) -> Optional[str]:
+    """
+    Check the content of a downloaded file is what its extension claims, from
+    a bounded prefix of text formats and the structure of binary formats
+    :param extension: extension of the file, including dot
+    :param content: content of the file
+    :return: why the content is invalid, None if it looks valid
+    """
+    check = CHECKS.get(extension.lower())
+    if check is None:
+        return f"unsupported extension {extension}"
+    return check(content)
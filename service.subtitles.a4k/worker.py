@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import socket
+import secrets
+import threading
+import socketserver
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import xbmc, xbmcaddon, xbmcvfs
+
+from base_adapter import (
+    CancellationToken,
+    SubtitleActionCancelled,
+    SubtitleAdapterBase,
+    SubtitleDownloadedFile,
+    SubtitleListItem,
+    SubtitleSearchInput,
+)
+
+WORKER_FILE = "worker.json"
+
+
+class WorkerUnavailable(Exception):
+    """
+    The resident worker could not be reached, the request should run in-process
+    """
+
+
+class WorkerError(Exception):
+    """
+    The resident worker was reached, but the adapter failed to serve the request
+    """
+
+
+class TTLCache:
+    """
+    Thread safe LRU cache whose entries expire after ttl seconds
+    """
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored = entry
+            if self._ttl is not None and time.monotonic() - stored > self._ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+def _worker_file(addon: xbmcaddon.Addon) -> str:
+    profile = xbmcvfs.translatePath(addon.getAddonInfo("profile"))
+    return os.path.join(profile, WORKER_FILE)
+
+
+class AdapterWorker:
+    """
+    Resident worker, run from the addon's xbmc.service extension.
+
+    It keeps one adapter alive, so its HTTP session (and warm connections),
+    and the caches below survive across plugin invocations. Plugin processes
+    talk to it through WorkerClient over a localhost socket; the port and an
+    access token are published in <profile>/worker.json.
+    """
+
+    SEARCH_TTL: float = 10 * 60
+    MAX_SEARCHES: int = 64
+    MAX_DOWNLOADS: int = 32
+
+    def __init__(self, adapter: SubtitleAdapterBase):
+        self._adapter = adapter
+        self._token = secrets.token_hex(16)
+        self._searches = TTLCache(self.MAX_SEARCHES, self.SEARCH_TTL)
+        # downloads of an item never change
+        self._downloads = TTLCache(self.MAX_DOWNLOADS)
+
+    def log(self, category, msg, level=xbmc.LOGDEBUG):
+        self._adapter.log(category, msg, level=level)
+
+    def search(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        item = SubtitleSearchInput(**params)
+        # automatic searches are driven by what is playing, so key on it too
+        key = (
+            json.dumps(params, sort_keys=True),
+            item.tvshow_title(),
+            item.title(),
+            item.season(),
+            item.episode(),
+        )
+        results = self._searches.get(key)
+        if results is None:
+            results = [asdict(it) for it in self._adapter.search(item)]
+            self._searches.put(key, results)
+        return results
+
+    def download(self, params: Dict[str, Any]) -> SubtitleDownloadedFile:
+        item_id = params["item_id"]
+        result = self._downloads.get(item_id)
+        if result is None:
+            result = self._adapter.download(item_id)
+            self._downloads.put(item_id, result)
+        return result
+
+    def handle(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        """
+        :param request: request of a plugin process
+        :return: response, and the raw body to send after it
+        """
+        __LOG_CATEGORY__ = "WORKER"
+
+        if request.get("token") != self._token:
+            return {"error": "invalid token"}, b""
+
+        method = request.get("method")
+        try:
+            if method == "ping":
+                return {"result": "pong"}, b""
+            elif method == "search":
+                return {"result": self.search(request["params"])}, b""
+            elif method == "download":
+                sub_file = self.download(request["params"])
+                result = {
+                    "file_name": sub_file.file_name,
+                    "content_type": sub_file.content_type,
+                    "content_length": sub_file.content_length,
+                }
+                return {"result": result}, sub_file.content
+            return {"error": f"unknown method: {method}"}, b""
+        except Exception as e:
+            self.log(__LOG_CATEGORY__, f"{method} failed: {e}", level=xbmc.LOGERROR)
+            return {"error": str(e)}, b""
+
+    def serve(self, monitor: xbmc.Monitor, worker_file: Optional[str] = None):
+        """
+        Serve plugin requests until Kodi asks the service to stop
+        :param monitor: xbmc.Monitor of the service
+        :param worker_file: where to publish port and token, defaults to
+        <profile>/worker.json
+        :return:
+        """
+        __LOG_CATEGORY__ = "WORKER"
+
+        worker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline())
+                except ValueError:
+                    return
+                response, body = worker.handle(request)
+                response["body"] = len(body)
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+                self.wfile.write(body)
+
+        worker_file = worker_file or _worker_file(self._adapter._addon)
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        os.makedirs(os.path.dirname(worker_file) or ".", exist_ok=True)
+        with open(worker_file, "w") as f:
+            json.dump({"port": server.server_address[1], "token": self._token}, f)
+        self.log(
+            __LOG_CATEGORY__,
+            f"listening on port {server.server_address[1]}",
+            level=xbmc.LOGINFO,
+        )
+
+        try:
+            while not monitor.abortRequested():
+                if monitor.waitForAbort(1):
+                    break
+        finally:
+            if os.path.exists(worker_file):
+                os.remove(worker_file)
+            server.shutdown()
+            server.server_close()
+            self.log(__LOG_CATEGORY__, "stopped", level=xbmc.LOGINFO)
+
+
+class WorkerClient:
+    CONNECT_TIMEOUT: float = 0.5
+    REQUEST_TIMEOUT: float = 60
+    POLL_INTERVAL: float = 0.1
+
+    def __init__(self, worker_file: str):
+        self._worker_file = worker_file
+
+    @classmethod
+    def for_addon(cls, addon: xbmcaddon.Addon) -> "WorkerClient":
+        return cls(_worker_file(addon))
+
+    def call(
+        self,
+        method: str,
+        params: Optional[Dict[str, Any]] = None,
+        token: Optional[CancellationToken] = None,
+    ) -> Tuple[Any, bytes]:
+        """
+        Send a request to the worker
+        :param method: ping, search or download
+        :param params: parameters of the method
+        :param token: CancellationToken, stop waiting for the worker once cancelled
+        :return: result of the method, and the raw body that came with it
+        :raise WorkerUnavailable: if the worker is down or went away
+        :raise WorkerError: if the worker failed to serve the request
+        :raise SubtitleActionCancelled: if the token was cancelled
+        """
+        try:
+            with open(self._worker_file, "r") as f:
+                info = json.load(f)
+        except (OSError, ValueError) as e:
+            raise WorkerUnavailable(f"no worker: {e}")
+
+        request = {"token": info["token"], "method": method, "params": params}
+        try:
+            with socket.create_connection(
+                ("127.0.0.1", info["port"]), timeout=self.CONNECT_TIMEOUT
+            ) as conn:
+                conn.sendall(json.dumps(request).encode() + b"\n")
+                response, body = self._read_response(conn, token)
+        except (OSError, ValueError) as e:
+            raise WorkerUnavailable(f"worker went away: {e}")
+
+        if "error" in response:
+            raise WorkerError(response["error"])
+        return response["result"], body
+
+    def _read_response(
+        self, conn: socket.socket, token: Optional[CancellationToken]
+    ) -> Tuple[Dict[str, Any], bytes]:
+        deadline = time.monotonic() + self.REQUEST_TIMEOUT
+        conn.settimeout(self.POLL_INTERVAL)
+        chunks = []
+        # the response line, then the raw body once the line is read
+        response, received, body_size = None, 0, 0
+        while response is None or received < body_size:
+            if token is not None and token.is_cancelled():
+                raise SubtitleActionCancelled()
+            if time.monotonic() > deadline:
+                raise socket.timeout("worker did not answer in time")
+            try:
+                chunk = conn.recv(64 * 1024)
+            except socket.timeout:
+                continue
+            if not chunk:
+                raise ConnectionError("worker closed the connection")
+            chunks.append(chunk)
+            received += len(chunk)
+            if response is None and b"\n" in chunk:
+                line, _, rest = b"".join(chunks).partition(b"\n")
+                response = json.loads(line)
+                body_size = response.get("body", 0)
+                chunks, received = [rest], len(rest)
+        return response, b"".join(chunks)
+
+
+class RemoteAdapter(SubtitleAdapterBase):
+    """
+    Thin adapter for the plugin entry: search/download are delegated to the
+    resident worker, and run in-process with the adapter built by fallback
+    when the worker is not available. UI handlers, load and unpack always
+    run in the plugin process, as they need its handle.
+    """
+
+    def __init__(
+        self,
+        addon: xbmcaddon.Addon,
+        client: WorkerClient,
+        fallback: Callable[[], SubtitleAdapterBase],
+    ):
+        super().__init__(addon)
+        self._client = client
+        self._fallback = fallback
+        self._local: Optional[SubtitleAdapterBase] = None
+
+    def _local_adapter(self) -> SubtitleAdapterBase:
+        if self._local is None:
+            self._local = self._fallback()
+        return self._local
+
+    def search(self, item: SubtitleSearchInput) -> List[SubtitleListItem]:
+        __LOG_CATEGORY__ = "SEARCH"
+
+        try:
+            results, _ = self._client.call("search", asdict(item), CancellationToken())
+        except WorkerUnavailable as e:
+            self.log(__LOG_CATEGORY__, f"{e}, searching in-process")
+            return self._local_adapter().search(item)
+        return [SubtitleListItem(**it) for it in results]
+
+    def download(self, item_id: str) -> SubtitleDownloadedFile:
+        __LOG_CATEGORY__ = "DOWNLOAD"
+
+        try:
+            result, content = self._client.call(
+                "download", {"item_id": item_id}, CancellationToken()
+            )
+        except WorkerUnavailable as e:
+            self.log(__LOG_CATEGORY__, f"{e}, downloading in-process")
+            return self._local_adapter().download(item_id)
+        return SubtitleDownloadedFile(**result, content=content)
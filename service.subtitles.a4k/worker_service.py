@@ -0,0 +1,7 @@
+import xbmc
+
+from adapter import A4KAdapter
+from worker import AdapterWorker
+
+if __name__ == "__main__":
+    AdapterWorker(A4KAdapter()).serve(xbmc.Monitor())
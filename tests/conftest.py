@@ -0,0 +1,36 @@
+import os
+import contextlib
+import pytest
+from unittest import mock
+
+import xbmc, xbmcaddon, xbmcvfs
+
+
+@pytest.fixture(autouse=True)
+def kodi(tmp_path):
+    """
+    Kodistubs return True for every bool and "" for every string, i.e. Kodi
+    exiting, every window visible and no addon profile. Give the tests an idle
+    Kodi instead, with the addon profile in a temporary directory.
+    """
+    info = {
+        "id": "service.subtitles.a4k",
+        "name": "a4k",
+        "profile": str(tmp_path / "profile"),
+    }
+    with contextlib.ExitStack() as stack:
+        for patch in (
+            mock.patch.object(xbmc.Monitor, "abortRequested", return_value=False),
+            mock.patch.object(xbmc.Player, "isPlayingVideo", return_value=False),
+            mock.patch("xbmc.getCondVisibility", return_value=False),
+            mock.patch.object(
+                xbmcaddon.Addon, "getAddonInfo", side_effect=lambda key: info[key]
+            ),
+            mock.patch("xbmcvfs.translatePath", side_effect=lambda path: path),
+            mock.patch("xbmcvfs.exists", side_effect=os.path.exists),
+            mock.patch(
+                "xbmcvfs.mkdirs", side_effect=lambda path: os.makedirs(path) or True
+            ),
+        ):
+            stack.enter_context(patch)
+        yield info
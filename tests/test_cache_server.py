@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append("./scripts")
+sys.path.append("./service.subtitles.a4k")
+
+import xbmcaddon
+from adapter import A4KAdapter
+from base_adapter import CancellationToken
+from cache_server import SubtitleCache, make_server
+from unittest import TestCase, mock
+
+
+def page(path, hit):
+    return f'<div class="download">origin {path} {hit}</div>'.encode()
+
+
+class StubOrigin(BaseHTTPRequestHandler):
+    hits = []
+
+    def do_GET(self):
+        StubOrigin.hits.append(self.path)
+        time.sleep(0.05)
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+            return
+        if self.path.startswith("/challenge") or self.path.endswith("bad.srt"):
+            # soft errors come as 200 pages
+            body = b"<!DOCTYPE html><html>checking your browser</html>"
+        elif self.path.endswith(".srt"):
+            body = f"1\r\n00:00:01,000 --> 00:00:02,000\r\n{self.path}\r\n".encode()
+        else:
+            body = page(self.path, len(StubOrigin.hits))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FailingCache(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_error(503)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestCacheServer(TestCase):
+    def setUp(self):
+        StubOrigin.hits = []
+        self._origin = ThreadingHTTPServer(("127.0.0.1", 0), StubOrigin)
+        self._store = tempfile.TemporaryDirectory()
+        self._cache = SubtitleCache(
+            self._store.name, f"http://127.0.0.1:{self._origin.server_port}", 0.2
+        )
+        self._server = make_server(self._cache, "127.0.0.1", 0, quiet=True)
+        for server in (self._origin, self._server):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        for server in (self._origin, self._server):
+            server.shutdown()
+            server.server_close()
+        self._store.cleanup()
+
+    def _get(self, path):
+        url = f"http://127.0.0.1:{self._server.server_port}{path}"
+        with urllib.request.urlopen(url) as response:
+            return response.headers["X-Cache"], response.read()
+
+    def test_immutable_downloads(self):
+        cache, body = self._get("/subtitle/1")
+        self.assertEqual("MISS", cache)
+        time.sleep(0.3)
+        self.assertEqual(("HIT", body), self._get("/subtitle/1"))
+        self.assertEqual(["/subtitle/1"], StubOrigin.hits)
+
+    def test_search_ttl(self):
+        cache, body = self._get("/search?term=abc")
+        self.assertEqual("MISS", cache)
+        self.assertEqual(("HIT", body), self._get("/search?term=abc"))
+        time.sleep(0.3)
+        self.assertEqual("MISS", self._get("/search?term=abc")[0])
+        self.assertEqual(2, len(StubOrigin.hits))
+
+    def test_errors_are_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(urllib.error.HTTPError) as e:
+                self._get("/missing")
+            self.assertEqual(404, e.exception.code)
+        self.assertEqual(2, len(StubOrigin.hits))
+
+    def test_error_pages_are_not_kept(self):
+        for path in ("/challenge", "/system/files/bad.srt"):
+            for _ in range(2):
+                self.assertEqual("MISS", self._get(path)[0])
+        self.assertEqual("MISS", self._get("/system/files/good.srt")[0])
+        self.assertEqual("HIT", self._get("/system/files/good.srt")[0])
+        self.assertEqual(5, len(StubOrigin.hits))
+
+    def test_eviction(self):
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        origin = f"http://127.0.0.1:{self._origin.server_port}"
+
+        def store_size():
+            return sum(os.path.getsize(e.path) for e in os.scandir(store.name))
+
+        SubtitleCache(store.name, origin, 60).get("/subtitle/0")
+        # room for 3 entries, the one stored is measured at start
+        max_size = int(store_size() * 3.5)
+        cache = SubtitleCache(store.name, origin, 60, max_size=max_size)
+        for path in ("/subtitle/1", "/subtitle/2", "/subtitle/0", "/subtitle/3"):
+            time.sleep(0.01)
+            cache.get(path)
+
+        self.assertLessEqual(store_size(), max_size)
+        # used last, so kept
+        self.assertTrue(cache.get("/subtitle/0")[3])
+        self.assertFalse(cache.get("/subtitle/1")[3])
+
+    def test_concurrent_misses_fetch_once(self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self._get("/subtitle/2")[1]))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(8, len(results))
+        self.assertEqual(1, len(set(results)))
+        self.assertEqual(["/subtitle/2"], StubOrigin.hits)
+
+
+class TestAdapterCacheServer(TestCase):
+    def setUp(self):
+        StubOrigin.hits = []
+        self._origin = ThreadingHTTPServer(("127.0.0.1", 0), StubOrigin)
+        self._failing = ThreadingHTTPServer(("127.0.0.1", 0), FailingCache)
+        self._store = tempfile.TemporaryDirectory()
+        self._cache = SubtitleCache(
+            self._store.name, f"http://127.0.0.1:{self._origin.server_port}", 60
+        )
+        self._server = make_server(self._cache, "127.0.0.1", 0, quiet=True)
+        for server in (self._origin, self._failing, self._server):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        self.settings = {"cache_server": ""}
+        for patch in (
+            mock.patch.object(
+                A4KAdapter,
+                "URL_BASE",
+                f"http://127.0.0.1:{self._origin.server_port}",
+            ),
+            mock.patch.object(
+                xbmcaddon.Addon,
+                "getSetting",
+                side_effect=lambda key: self.settings[key],
+            ),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.sa = A4KAdapter()
+        self.sa.coordinator().RATE = 1000.0
+
+    def tearDown(self):
+        for server in (self._origin, self._failing, self._server):
+            server.shutdown()
+            server.server_close()
+        self._store.cleanup()
+
+    def _fetch(self, path):
+        body, headers = self.sa._fetch(path, 0, CancellationToken())
+        return headers.get("x-cache"), body
+
+    def test_cache_server_down(self):
+        # a port nothing listens on
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.settings["cache_server"] = f"http://127.0.0.1:{port}"
+
+        self.assertEqual((None, page("/subtitle/1", 1)), self._fetch("/subtitle/1"))
+
+    def test_cache_server_error(self):
+        self.settings["cache_server"] = f"http://127.0.0.1:{self._failing.server_port}/"
+
+        self.assertEqual((None, page("/subtitle/1", 1)), self._fetch("/subtitle/1"))
+
+    def test_setting_read_per_request(self):
+        self.assertEqual((None, page("/subtitle/1", 1)), self._fetch("/subtitle/1"))
+
+        # set while the adapter is alive, as in the resident worker
+        self.settings["cache_server"] = f"http://127.0.0.1:{self._server.server_port}"
+        self.assertEqual(("MISS", page("/subtitle/2", 2)), self._fetch("/subtitle/2"))
+        self.assertEqual(("HIT", page("/subtitle/2", 2)), self._fetch("/subtitle/2"))
+        self.assertEqual(["/subtitle/1", "/subtitle/2"], StubOrigin.hits)
@@ -0,0 +1,263 @@
+import gc
+import os
+import sys
+import time
+import threading
+import zipfile
+import tempfile
+import tracemalloc
+import contextlib
+import urllib.parse
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+sys.path.append("./service.subtitles.a4k")
+
+import xbmcaddon
+from adapter import A4KAdapter
+from base_adapter import SubtitleDownloadedFile
+from worker import AdapterWorker, RemoteAdapter, WorkerClient
+from unittest import TestCase, mock
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "a4k")
+
+# path requested from a4k.net -> fixture file, content type
+ROUTES: Dict[str, Tuple[str, str]] = {
+    "/search?term=流浪地球": ("search.html", "text/html; charset=UTF-8"),
+    "/subtitle/108502": ("subtitle_108502.html", "text/html; charset=UTF-8"),
+    "/subtitle/131634": ("subtitle_131634.html", "text/html; charset=UTF-8"),
+    "/system/files/subtitle/2020-06/a4k.net_1591786049_0.zip": (
+        "a4k.net_1591786049_0.zip",
+        "application/zip",
+    ),
+    "/system/files/subtitle/2020-12/a4k.net_1608213495_0.ass": (
+        "a4k.net_1608213495_0.ass",
+        "application/octet-stream",
+    ),
+}
+
+
+@dataclass
+class Budget:
+    peak: int  # bytes allocated at the peak of the stage
+    blocks: int  # memory blocks the stage left allocated once it returned
+
+
+# measured on a warm run with some headroom, yet low enough to catch a tree of
+# the whole page or another copy of the file. Raise one only if the increase
+# is understood and agreed
+BUDGETS: Dict[str, Budget] = {
+    "search": Budget(peak=900_000, blocks=300),
+    "download": Budget(peak=180_000, blocks=60),
+    "load": Budget(peak=32_000, blocks=20),
+    "unpack": Budget(peak=32_000, blocks=40),
+    "router_download": Budget(peak=240_000, blocks=60),
+    # the file comes from the resident worker, as service.py runs it
+    "remote_router_download": Budget(peak=210_000, blocks=60),
+}
+
+
+class FakeResponse:
+    """
+    streamed response, reading the body from the fixture as it is consumed
+    """
+
+    def __init__(self, path: str, content_type: str):
+        self._file = open(path, "rb")
+        self.headers = {
+            "Content-Type": content_type,
+            "Content-Length": str(os.path.getsize(path)),
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        return iter(lambda: self._file.read(chunk_size), b"")
+
+
+class FakeSession:
+    """
+    requests session serving the recorded a4k.net fixtures
+    """
+
+    def get(self, url, timeout=None, stream=False):
+        file_name, content_type = ROUTES[url[len(A4KAdapter.URL_BASE) :]]
+        return FakeResponse(os.path.join(FIXTURES, file_name), content_type)
+
+
+class Monitor:
+    def __init__(self):
+        self._abort = threading.Event()
+
+    def abortRequested(self):
+        return self._abort.is_set()
+
+    def waitForAbort(self, timeout):
+        return self._abort.wait(timeout)
+
+    def abort(self):
+        self._abort.set()
+
+
+def zip_listdir(path: str):
+    """
+    xbmcvfs.listdir for zip:// urls, as built by unpack
+    """
+    archive, _, inner = path[len("zip://") :].partition("/")
+    prefix = f"{inner.strip('/')}/" if inner.strip("/") else ""
+    dirs, files = set(), []
+    with zipfile.ZipFile(urllib.parse.unquote_plus(archive)) as z:
+        for name in z.namelist():
+            if not name.startswith(prefix):
+                continue
+            head, sep, _ = name[len(prefix) :].partition("/")
+            if sep:
+                dirs.add(head)
+            elif head:
+                files.append(head)
+    return sorted(dirs), files
+
+
+@contextlib.contextmanager
+def measure():
+    """
+    Measure the peak memory of the block, and the memory blocks it left
+    allocated, leaving out tracemalloc's own allocations and the calls
+    recorded by mocks
+    """
+    usage = {}
+    ignore = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, mock.__file__),
+    ]
+    gc.collect()
+    before = tracemalloc.take_snapshot().filter_traces(ignore)
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    yield usage
+    _, peak = tracemalloc.get_traced_memory()
+    gc.collect()
+    after = tracemalloc.take_snapshot().filter_traces(ignore)
+    usage["peak"] = peak - baseline
+    usage["blocks"] = sum(
+        max(stat.count_diff, 0) for stat in after.compare_to(before, "traceback")
+    )
+
+
+class TestMemory(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.sa = A4KAdapter()
+        self.sa._session = FakeSession()
+        # no rate limiting, and every request goes to the session
+        self.sa.coordinator().RATE = 1000.0
+        for patch in (
+            mock.patch.object(A4KAdapter, "SEARCH_TTL", 0),
+            mock.patch.object(A4KAdapter, "DOWNLOAD_TTL", 0),
+            mock.patch("xbmcvfs.listdir", side_effect=zip_listdir),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        tracemalloc.start(8)
+
+    def tearDown(self):
+        tracemalloc.stop()
+        self._tmp_dir.cleanup()
+
+    def assertWithinBudget(self, stage: str, func, *args):
+        # the first run pays for imports, regex compilation and other caches
+        func(*args)
+        threads = threading.active_count()
+        with measure() as usage:
+            result = func(*args)
+            # the action's threads (see DaemonThreadExecutor) are still exiting
+            while threading.active_count() > threads:
+                time.sleep(0.01)
+        budget = BUDGETS[stage]
+        self.assertLessEqual(
+            usage["peak"], budget.peak, f"{stage}: peak over budget, {usage}"
+        )
+        self.assertLessEqual(
+            usage["blocks"], budget.blocks, f"{stage}: blocks over budget, {usage}"
+        )
+        return result
+
+    def test_search(self):
+        with mock.patch("xbmcplugin.addDirectoryItems") as add_items:
+            self.assertWithinBudget(
+                "search",
+                self.sa.router,
+                1,
+                "?action=manualsearch&languages=Chinese&preferredlanguage=Chinese"
+                "&searchstring=流浪地球",
+            )
+        _, items, total = add_items.call_args[0]
+        self.assertEqual(40, total)
+
+    def test_download(self):
+        download = self.assertWithinBudget(
+            "download", self.sa.download, "/subtitle/108502"
+        )
+        self.assertEqual("a4k.net_1591786049_0.zip", download.file_name)
+        self.assertEqual(61439, len(download.content))
+
+    def test_load(self):
+        with open(os.path.join(FIXTURES, "a4k.net_1608213495_0.ass"), "rb") as f:
+            content = f.read()
+        download = SubtitleDownloadedFile(
+            "a4k.net_1608213495_0.ass", "text/plain", len(content), content
+        )
+        del content
+        path = self.assertWithinBudget(
+            "load", self.sa.load, download, self._tmp_dir.name
+        )
+        self.assertEqual(len(download.content), os.stat(path).st_size)
+
+    def test_unpack(self):
+        path = os.path.join(self._tmp_dir.name, "a4k.net_1591786049_0.zip")
+        with open(os.path.join(FIXTURES, "a4k.net_1591786049_0.zip"), "rb") as src:
+            with open(path, "wb") as dst:
+                dst.write(src.read())
+        sub_files = self.assertWithinBudget("unpack", self.sa.unpack, path)
+        self.assertEqual(3, len(sub_files))
+
+    def test_router_download(self):
+        with mock.patch("xbmcplugin.addDirectoryItem") as add_item:
+            self.assertWithinBudget(
+                "router_download",
+                self.sa.router,
+                1,
+                "?action=download&item_id=/subtitle/108502&name=流浪地球",
+            )
+        self.assertRegex(add_item.call_args[1]["url"], r"\.ass$")
+
+    def test_remote_router_download(self):
+        # the first run fills the worker's cache of downloads, the measured one
+        # is the copies of the file between the worker and the plugin
+        worker_file = os.path.join(self._tmp_dir.name, "worker.json")
+        monitor = Monitor()
+        worker = threading.Thread(
+            target=AdapterWorker(self.sa).serve, args=(monitor, worker_file)
+        )
+        worker.start()
+        self.addCleanup(worker.join)
+        self.addCleanup(monitor.abort)
+        while not os.path.exists(worker_file):
+            time.sleep(0.01)
+
+        sa = RemoteAdapter(xbmcaddon.Addon(), WorkerClient(worker_file), None)
+        with mock.patch("xbmcplugin.addDirectoryItem") as add_item:
+            self.assertWithinBudget(
+                "remote_router_download",
+                sa.router,
+                1,
+                "?action=download&item_id=/subtitle/108502&name=流浪地球",
+            )
+        self.assertRegex(add_item.call_args[1]["url"], r"\.ass$")
@@ -0,0 +1,118 @@
+import os
+import sys
+import gzip
+import shutil
+import hashlib
+import tempfile
+from xml.dom import minidom
+from xml.dom.minidom import Node
+
+sys.path.append("./scripts")
+
+from publish import Generator, FragmentCache
+from unittest import TestCase
+
+ADDONS = ["service.subtitles.a4k", "repository.ileodo-kodi-addons"]
+
+
+def legacy_addons_xml(addons):
+    """
+    addons.xml as produced by the previous minidom based implementation
+    """
+
+    def remove_blanks(node):
+        for x in node.childNodes:
+            if x.nodeType == Node.TEXT_NODE:
+                if x.nodeValue:
+                    x.nodeValue = x.nodeValue.strip()
+            elif x.nodeType == Node.ELEMENT_NODE:
+                remove_blanks(x)
+
+    xml = minidom.parseString("<addons></addons>")
+    for addon in sorted(addons):
+        addon_xml = minidom.parse(os.path.join(addon, "addon.xml"))
+        for node in addon_xml.getElementsByTagName("addon"):
+            xml.documentElement.appendChild(node)
+    remove_blanks(xml)
+    xml.normalize()
+    return xml.toprettyxml(indent=" " * 4).encode("utf-8")
+
+
+class TestPublish(TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp_dir = tempfile.mkdtemp()
+        for addon in ADDONS:
+            os.mkdir(os.path.join(self._tmp_dir, addon))
+            shutil.copy(
+                os.path.join(addon, "addon.xml"),
+                os.path.join(self._tmp_dir, addon, "addon.xml"),
+            )
+        os.chdir(self._tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmp_dir)
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_output_matches_legacy_output(self):
+        Generator(ADDONS, "addons.xml", "addons.xml.md5")
+
+        expected = legacy_addons_xml(ADDONS)
+        self.assertEqual(expected, self._read("addons.xml"))
+        self.assertEqual(
+            hashlib.md5(expected).hexdigest().encode("utf-8"),
+            self._read("addons.xml.md5"),
+        )
+
+    def test_cache(self):
+        Generator(ADDONS, "addons.xml", "addons.xml.md5", "cache.json")
+        expected = self._read("addons.xml")
+
+        # touched but unchanged files are resolved by hash
+        os.utime(os.path.join(ADDONS[0], "addon.xml"))
+        cache = FragmentCache("cache.json")
+        for addon in ADDONS:
+            cache.fragments(os.path.join(addon, "addon.xml"))
+        self.assertEqual((2, 0), (cache.hits, cache.misses))
+
+        Generator(ADDONS, "addons.xml", "addons.xml.md5", "cache.json")
+        self.assertEqual(expected, self._read("addons.xml"))
+
+        # changed files are parsed again
+        addon_path = os.path.join(ADDONS[0], "addon.xml")
+        with open(addon_path, "r", encoding="utf-8") as f:
+            cont = f.read()
+        with open(addon_path, "w", encoding="utf-8") as f:
+            f.write(cont.replace('name="a4k"', 'name="a4k changed"', 1))
+
+        Generator(ADDONS, "addons.xml", "addons.xml.md5", "cache.json")
+        self.assertIn(b'name="a4k changed"', self._read("addons.xml"))
+
+    def test_compressed_index_and_checksums(self):
+        zip_path = os.path.join("dest", ADDONS[0], f"{ADDONS[0]}-0.0.2.zip")
+        os.makedirs(os.path.dirname(zip_path))
+        with open(zip_path, "wb") as f:
+            f.write(b"PK\x05\x06" + b"\x00" * 18)
+
+        Generator(
+            ADDONS,
+            "addons.xml",
+            "addons.xml.md5",
+            gz_path="addons.xml.gz",
+            dest="dest",
+        )
+
+        gz_cont = self._read("addons.xml.gz")
+        self.assertEqual(self._read("addons.xml"), gzip.decompress(gz_cont))
+        self.assertEqual(
+            hashlib.sha256(gz_cont).hexdigest().encode("utf-8"),
+            self._read("addons.xml.gz.sha256"),
+        )
+        self.assertEqual(
+            hashlib.sha256(self._read(zip_path)).hexdigest().encode("utf-8"),
+            self._read(f"{zip_path}.sha256"),
+        )
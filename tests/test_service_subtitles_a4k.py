@@ -1,15 +1,46 @@
+import io
 import sys
 import os
+import zipfile
 import tempfile
+import asyncio
+import threading
+import time
 import pytest
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 sys.path.append("./service.subtitles.a4k")
 
+import xbmcaddon
 from adapter import A4KAdapter as SubtitleAdapter
-from base_adapter import SubtitleSearchInput, SubtitleDownloadedFile
-from unittest import TestCase
+from base_adapter import (
+    AsyncSubtitleAdapterBase,
+    CancellationToken,
+    SubtitleActionCancelled,
+    SubtitleAdapterBase,
+    SubtitleSearchInput,
+    SubtitleListItem,
+    SubtitleDownloadedFile,
+)
+from coordination import RequestCancelled, RequestCoordinator
+from history import SubtitleChoice, SubtitleHistory, rank_by_history, video_fingerprint
+from retiming import Retiming, fps_from_name, parse_times, retime, snap_fps
+from validation import validate
+from worker import AdapterWorker, RemoteAdapter, WorkerClient
+from unittest import TestCase, mock
 from parameterized import parameterized
 
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "a4k")
+
+
+def fixture(file_name):
+    with open(os.path.join(FIXTURES, file_name), "rb") as f:
+        return f.read()
+
+
+SRT = "1\r\n00:00:01,000 --> 00:00:02,500\r\n你好\r\n".encode("utf-8")
+
 
 class TestPlugin(TestCase):
     @parameterized.expand(
@@ -74,3 +105,734 @@ class TestPlugin(TestCase):
             self.assertRegex(loaded_path, rf"{tmp_dir}")
             self.assertRegex(loaded_path, r"sub_.+\.ass")
             self.assertEqual(211624, os.stat(loaded_path).st_size)
+
+
+class FakeAdapter(SubtitleAdapterBase):
+    def __init__(self):
+        super().__init__(xbmcaddon.Addon())
+        self.calls = 0
+
+    def search(self, item):
+        self.calls += 1
+        return [SubtitleListItem("name", "/subtitle/1", "2023", "zh", "简体", "zh", 0)]
+
+    def download(self, item_id):
+        self.calls += 1
+        return SubtitleDownloadedFile("a.srt", "text/plain", 12, b"\x00\xff12345678")
+
+
+class FakeMonitor:
+    def __init__(self):
+        self._abort = threading.Event()
+
+    def abortRequested(self):
+        return self._abort.is_set()
+
+    def waitForAbort(self, timeout):
+        return self._abort.wait(timeout)
+
+
+class TestWorker(TestCase):
+    def test_delegate_to_worker(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            worker_file = os.path.join(tmp_dir, "worker.json")
+            remote = FakeAdapter()
+            monitor = FakeMonitor()
+            thread = threading.Thread(
+                target=AdapterWorker(remote).serve,
+                args=(monitor, worker_file),
+                daemon=True,
+            )
+            thread.start()
+            try:
+                while not os.path.exists(worker_file):
+                    time.sleep(0.01)
+
+                sa = RemoteAdapter(xbmcaddon.Addon(), WorkerClient(worker_file), None)
+                item = SubtitleSearchInput([], [], "流浪地球")
+                expected_results = FakeAdapter().search(item)
+                expected_file = FakeAdapter().download("/subtitle/1")
+
+                self.assertEqual(expected_results, sa.search(item))
+                self.assertEqual(expected_results, sa.search(item))
+                self.assertEqual(expected_file, sa.download("/subtitle/1"))
+                # the second search is served from the worker cache
+                self.assertEqual(2, remote.calls)
+            finally:
+                monitor._abort.set()
+                thread.join()
+            self.assertFalse(os.path.exists(worker_file))
+
+    def test_fallback_when_worker_is_down(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local = FakeAdapter()
+            sa = RemoteAdapter(
+                xbmcaddon.Addon(),
+                WorkerClient(os.path.join(tmp_dir, "worker.json")),
+                lambda: local,
+            )
+            item = SubtitleSearchInput([], [], "流浪地球")
+            self.assertEqual(FakeAdapter().search(item), sa.search(item))
+            self.assertEqual(1, local.calls)
+
+
+class SlowAsyncAdapter(AsyncSubtitleAdapterBase):
+    def __init__(self):
+        super().__init__(xbmcaddon.Addon())
+
+    async def search_async(self, item, token):
+        # two overlapping fetches
+        await asyncio.gather(
+            self.run_blocking(time.sleep, 0.3), self.run_blocking(time.sleep, 0.3)
+        )
+        return []
+
+    async def download_async(self, item_id, token):
+        await self.run_blocking(time.sleep, 1)
+        return SubtitleDownloadedFile("a.srt", "text/plain", 12, b"123456789012")
+
+
+class TricklingOrigin(BaseHTTPRequestHandler):
+    # a file of as many 16 KiB chunks as the last part of the path, coming in
+    # slowly
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        TricklingOrigin.connections += 1
+
+    def do_GET(self):
+        chunks = int(self.path.rsplit("/", 1)[1])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(chunks * 16 * 1024))
+        self.end_headers()
+        try:
+            for _ in range(chunks):
+                self.wfile.write(bytes(16 * 1024))
+                time.sleep(0.05)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAsyncAdapter(TestCase):
+    def test_overlapping_fetches(self):
+        start = time.monotonic()
+        SlowAsyncAdapter().search(SubtitleSearchInput([], [], "流浪地球"))
+        self.assertLess(time.monotonic() - start, 0.55)
+
+    def test_cancel(self):
+        token = CancellationToken()
+        threading.Timer(0.2, token.cancel).start()
+
+        start = time.monotonic()
+        sa = SlowAsyncAdapter()
+        with self.assertRaises(SubtitleActionCancelled):
+            sa.run(sa.download_async, "/subtitle/1", token=token)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_cancel_when_kodi_exits(self):
+        monitor = FakeMonitor()
+        token = CancellationToken(monitor)
+        threading.Timer(0.2, monitor._abort.set).start()
+
+        start = time.monotonic()
+        sa = SlowAsyncAdapter()
+        with self.assertRaises(SubtitleActionCancelled):
+            sa.run(sa.download_async, "/subtitle/1", token=token)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_cancel_when_dialog_closes(self):
+        visible = threading.Event()
+        visible.set()
+        with mock.patch(
+            "xbmc.getCondVisibility", side_effect=lambda _: visible.is_set()
+        ):
+            token = CancellationToken(FakeMonitor())
+            threading.Timer(0.2, visible.clear).start()
+
+            start = time.monotonic()
+            sa = SlowAsyncAdapter()
+            with self.assertRaises(SubtitleActionCancelled):
+                sa.run(sa.download_async, "/subtitle/1", token=token)
+            self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_cancel_does_not_hold_process(self):
+        # a cancelled action's blocking call must not delay the process exit
+        script = (
+            "import sys, time, threading\n"
+            "sys.path.append('./service.subtitles.a4k')\n"
+            "import xbmcaddon\n"
+            "from base_adapter import (\n"
+            "    AsyncSubtitleAdapterBase,\n"
+            "    CancellationToken,\n"
+            "    SubtitleActionCancelled,\n"
+            ")\n"
+            "class Adapter(AsyncSubtitleAdapterBase):\n"
+            "    async def search_async(self, item, token):\n"
+            "        return []\n"
+            "    async def download_async(self, item_id, token):\n"
+            "        await self.run_blocking(time.sleep, 5)\n"
+            "class Monitor:\n"
+            "    def abortRequested(self):\n"
+            "        return False\n"
+            "token = CancellationToken(Monitor())\n"
+            "threading.Timer(0.2, token.cancel).start()\n"
+            "sa = Adapter(xbmcaddon.Addon())\n"
+            "try:\n"
+            "    sa.run(sa.download_async, '/subtitle/1', token=token)\n"
+            "except SubtitleActionCancelled:\n"
+            "    pass\n"
+        )
+        start = time.monotonic()
+        subprocess.run([sys.executable, "-c", script], check=True, timeout=10)
+        self.assertLess(time.monotonic() - start, 4)
+
+    def test_fetch_stops_waiting_when_cancelled(self):
+        sa = SubtitleAdapter()
+        db_path = os.path.join(sa._addon_profile, "requests.db")
+        sa.coordinator()
+        # another process fetching the same page
+        leader = threading.Thread(
+            target=RequestCoordinator(db_path).fetch,
+            args=(
+                f"{SubtitleAdapter.URL_BASE}/subtitle/1",
+                None,
+                lambda: time.sleep(1) or (b"", {}),
+            ),
+        )
+        leader.start()
+        time.sleep(0.1)
+
+        token = CancellationToken(FakeMonitor())
+        threading.Timer(0.1, token.cancel).start()
+        start = time.monotonic()
+        with self.assertRaises(RequestCancelled):
+            sa._fetch("/subtitle/1", SubtitleAdapter.DOWNLOAD_TTL, token)
+        self.assertLess(time.monotonic() - start, 0.5)
+        leader.join()
+
+    def trickling_adapter(self) -> SubtitleAdapter:
+        origin = ThreadingHTTPServer(("127.0.0.1", 0), TricklingOrigin)
+        origin.daemon_threads = True
+        threading.Thread(target=origin.serve_forever, daemon=True).start()
+        self.addCleanup(origin.server_close)
+        self.addCleanup(origin.shutdown)
+        patch = mock.patch.object(
+            SubtitleAdapter, "URL_BASE", f"http://127.0.0.1:{origin.server_port}"
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        sa = SubtitleAdapter()
+        sa.coordinator().RATE = 1000.0
+        return sa
+
+    def test_fetch_stops_downloading_when_cancelled(self):
+        sa = self.trickling_adapter()
+        token = CancellationToken(FakeMonitor())
+        threading.Timer(0.3, token.cancel).start()
+        start = time.monotonic()
+        with self.assertRaises(RequestCancelled):
+            sa._fetch("/subtitle/4096", SubtitleAdapter.DOWNLOAD_TTL, token)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_cancel_leaves_other_actions_alone(self):
+        # actions of the resident worker share the adapter and its connections
+        sa = self.trickling_adapter()
+
+        async def fetch(path, token):
+            body, _ = await sa.run_blocking(
+                sa._fetch, path, SubtitleAdapter.DOWNLOAD_TTL, token
+            )
+            return body
+
+        cancelled = CancellationToken(FakeMonitor())
+        threading.Timer(0.2, cancelled.cancel).start()
+        errors = []
+
+        def cancelled_action():
+            try:
+                sa.run(fetch, "/subtitle/4096", token=cancelled)
+            except SubtitleActionCancelled as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=cancelled_action)
+        thread.start()
+        time.sleep(0.1)
+        connections = TricklingOrigin.connections
+        token = CancellationToken(FakeMonitor())
+        self.assertEqual(
+            10 * 16 * 1024, len(sa.run(fetch, "/subtitle/10", token=token))
+        )
+        thread.join()
+        self.assertEqual(1, len(errors))
+        # the connection of the other action is still warm
+        sa.run(fetch, "/subtitle/1", token=token)
+        self.assertEqual(connections + 1, TricklingOrigin.connections)
+
+
+class TestRender(TestCase):
+    def test_search_handler_batches_items(self):
+        sa = FakeAdapter()
+        with mock.patch("xbmcplugin.addDirectoryItems") as add_items, mock.patch(
+            "xbmcplugin.addDirectoryItem"
+        ) as add_item:
+            sa.search_handler(1, SubtitleSearchInput([], [], "流浪地球"))
+
+        add_item.assert_not_called()
+        add_items.assert_called_once()
+        handle, items, total = add_items.call_args[0]
+        self.assertEqual((1, 1), (handle, total))
+        url, _, is_folder = items[0]
+        self.assertFalse(is_folder)
+        params = SubtitleAdapterBase._get_param_dict(url.split("/", 3)[-1])
+        self.assertEqual("download", params["action"])
+        self.assertEqual("/subtitle/1", params["item_id"])
+        self.assertEqual("name", params["name"])
+        self.assertEqual("简体", params["language_name"])
+
+
+class LocalFile:
+    """
+    xbmcvfs.File over the local file system
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+
+    def size(self):
+        return os.fstat(self._file.fileno()).st_size
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def readBytes(self, n=-1):
+        return bytearray(self._file.read(n))
+
+    def close(self):
+        self._file.close()
+
+
+class TestHistory(TestCase):
+    def test_video_fingerprint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            video = os.path.join(tmp_dir, "video.mkv")
+            with open(video, "wb") as f:
+                f.write(os.urandom(1024 * 1024))
+
+            with mock.patch("xbmcvfs.File", LocalFile):
+                fingerprint = video_fingerprint(video)
+                self.assertEqual(fingerprint, video_fingerprint(video))
+
+                # the middle of the file is not part of the fingerprint
+                with open(video, "r+b") as f:
+                    f.seek(512 * 1024)
+                    f.write(b"changed")
+                self.assertEqual(fingerprint, video_fingerprint(video))
+
+                with open(video, "ab") as f:
+                    f.write(b"changed")
+                self.assertNotEqual(fingerprint, video_fingerprint(video))
+
+    def test_rank_by_history(self):
+        names = [
+            "Show.S01E03.720p.WEB-DL-GRP1.srt",
+            "Show.S01E03.1080p.BluRay-GRP2.srt",
+            "Show.S01E03.Other.srt",
+        ]
+        self.assertEqual(
+            [names[1], names[0], names[2]],
+            rank_by_history(names, ["Show.S01E02.1080p.BluRay-GRP2.ass"], str),
+        )
+        self.assertEqual(names, rank_by_history(names, [], str))
+
+    def test_remember_choice(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sa = FakeAdapter()
+            sa._addon_profile = tmp_dir
+            choice = SubtitleChoice("/subtitle/2", "chosen", "zh", "简体", "zh", "a.srt")
+            sa.history().remember("fingerprint", "Show", choice)
+
+            history = SubtitleHistory(os.path.join(tmp_dir, "history.db"))
+            self.assertEqual(choice, history.lookup("fingerprint"))
+            self.assertEqual(["chosen"], sa.history().recent_names("Show"))
+
+            results = sa.apply_history(
+                sa.search(SubtitleSearchInput([], [], "Show")),
+                sa.remembered_choice("fingerprint"),
+                "Show",
+            )
+            self.assertEqual(["/subtitle/2", "/subtitle/1"], [x.item_id for x in results])
+            self.assertEqual(SubtitleListItem.MAX_RATING, results[0].rating)
+
+    def test_played_again_lists_choice_without_searching(self):
+        sa = FakeAdapter()
+        choice = SubtitleChoice("/subtitle/2", "chosen", "zh", "简体", "zh", "a.srt")
+        sa.history().remember("fingerprint", "", choice)
+
+        with mock.patch.object(
+            sa, "playing_fingerprint", return_value="fingerprint"
+        ), mock.patch("xbmcplugin.addDirectoryItems") as add_items:
+            sa.search_handler(1, SubtitleSearchInput(["Chinese"], ["Chinese"], None))
+
+        _, items, total = add_items.call_args[0]
+        self.assertEqual(1, total)
+        self.assertIn("item_id=%2Fsubtitle%2F2", items[0][0])
+        self.assertEqual(0, sa.calls)
+
+    def test_failed_search_keeps_choice(self):
+        sa = FakeAdapter()
+        choice = SubtitleChoice("/subtitle/2", "chosen", "zh", "简体", "zh", "a.srt")
+        sa.history().remember("fingerprint", "", choice)
+
+        with mock.patch.object(
+            sa, "playing_fingerprint", return_value="fingerprint"
+        ), mock.patch.object(
+            sa, "search", side_effect=IOError("a4k.net is down")
+        ), mock.patch(
+            "xbmcplugin.addDirectoryItems"
+        ) as add_items:
+            sa.search_handler(1, SubtitleSearchInput([], [], "Show"))
+
+        _, items, total = add_items.call_args[0]
+        self.assertEqual(1, total)
+        self.assertIn("item_id=%2Fsubtitle%2F2", items[0][0])
+
+    def test_dead_choice_is_forgotten_and_searched_past(self):
+        sa = FallbackAdapter()
+        # no longer on the site
+        choice = SubtitleChoice("/subtitle/2", "chosen", "zh", "简体", "zh", None)
+        sa.history().remember("fingerprint", "", choice)
+
+        with mock.patch.object(
+            sa, "playing_fingerprint", return_value="fingerprint"
+        ), mock.patch("xbmcplugin.addDirectoryItems") as add_items, mock.patch(
+            "xbmcplugin.addDirectoryItem"
+        ) as add_item:
+            sa.search_handler(1, SubtitleSearchInput(["Chinese"], ["Chinese"], None))
+            _, items, _ = add_items.call_args[0]
+            sa.router(1, items[0][0].split("/", 3)[3])
+
+        # the remembered one, then the search results: 1 is an error page
+        self.assertEqual(["/subtitle/2", "/subtitle/1", "/subtitle/3"], sa.downloads)
+        self.assertRegex(add_item.call_args[1]["url"], r"\.srt$")
+        self.assertIsNone(sa.remembered_choice("fingerprint"))
+
+
+class TestCoordination(TestCase):
+    def test_single_flight(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "requests.db")
+            fetches = []
+            results = []
+
+            def fetch():
+                fetches.append(1)
+                time.sleep(0.2)
+                return b"body", {"content-type": "text/html"}
+
+            def request():
+                # one coordinator per simulated process
+                results.append(RequestCoordinator(db_path).fetch("url", "host", fetch))
+
+            threads = [threading.Thread(target=request) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(1, len(fetches))
+            self.assertEqual([(b"body", {"content-type": "text/html"})] * 4, results)
+
+    def test_leader_failure(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            coordinator = RequestCoordinator(os.path.join(tmp_dir, "requests.db"))
+
+            def fail():
+                raise IOError("failed")
+
+            with self.assertRaises(IOError):
+                coordinator.fetch("url", "host", fail)
+            self.assertEqual(
+                (b"body", {}), coordinator.fetch("url", "host", lambda: (b"body", {}))
+            )
+
+    def test_rate_limit(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            coordinator = RequestCoordinator(os.path.join(tmp_dir, "requests.db"))
+            coordinator.RATE = 10.0
+            coordinator.BURST = 1.0
+
+            start = time.monotonic()
+            for _ in range(3):
+                coordinator.acquire("host")
+            self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_dead_leader(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "requests.db")
+            code = (
+                "import sys, time\n"
+                "sys.path.append('./service.subtitles.a4k')\n"
+                "from coordination import RequestCoordinator\n"
+                f"RequestCoordinator({db_path!r}).fetch("
+                "'url', 'host', lambda: print('fetching', flush=True) or time.sleep(60))"
+            )
+            leader = subprocess.Popen(
+                [sys.executable, "-c", code], stdout=subprocess.PIPE, text=True
+            )
+            self.assertEqual("fetching\n", leader.stdout.readline())
+            leader.kill()
+            leader.wait()
+            leader.stdout.close()
+
+            start = time.monotonic()
+            self.assertEqual(
+                (b"body", {}),
+                RequestCoordinator(db_path).fetch("url", "host", lambda: (b"body", {})),
+            )
+            self.assertLess(time.monotonic() - start, 1)
+
+    def test_followers_poll_without_write_lock(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "requests.db")
+            leader = threading.Thread(
+                target=RequestCoordinator(db_path).fetch,
+                args=("url", "host", lambda: time.sleep(0.5) or (b"body", {})),
+            )
+            leader.start()
+            time.sleep(0.1)
+
+            follower = RequestCoordinator(db_path)
+            with mock.patch.object(
+                follower, "_transaction", wraps=follower._transaction
+            ) as transaction:
+                self.assertEqual(
+                    (b"body", {}), follower.fetch("url", "host", lambda: (b"", {}))
+                )
+            transaction.assert_not_called()
+            leader.join()
+
+    def test_cancel_wait(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "requests.db")
+            leader = threading.Thread(
+                target=RequestCoordinator(db_path).fetch,
+                args=("url", "host", lambda: time.sleep(1) or (b"body", {})),
+            )
+            leader.start()
+            time.sleep(0.1)
+
+            cancelled = threading.Event()
+            threading.Timer(0.1, cancelled.set).start()
+            start = time.monotonic()
+            with self.assertRaises(RequestCancelled):
+                RequestCoordinator(db_path).fetch(
+                    "url", "host", lambda: (b"other", {}), cancelled=cancelled.is_set
+                )
+            self.assertLess(time.monotonic() - start, 0.5)
+
+            coordinator = RequestCoordinator(db_path)
+            coordinator.RATE = 0.1
+            coordinator.BURST = 1.0
+            coordinator.acquire("host")
+            start = time.monotonic()
+            with self.assertRaises(RequestCancelled):
+                coordinator.acquire("host", cancelled=cancelled.is_set)
+            self.assertLess(time.monotonic() - start, 0.5)
+            leader.join()
+
+
+class FallbackAdapter(FakeAdapter):
+    FILES = {
+        "/subtitle/1": SubtitleDownloadedFile(
+            "a.srt", "text/html", 100, b"<!DOCTYPE html><html>error</html>" * 3
+        ),
+        "/subtitle/3": SubtitleDownloadedFile("c.srt", "text/plain", len(SRT), SRT),
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.downloads = []
+
+    def search(self, item):
+        return [
+            SubtitleListItem(f"name{i}", f"/subtitle/{i}", "", "zh", "简体", "zh", 0)
+            for i in range(1, 6)
+        ]
+
+    def download(self, item_id):
+        self.downloads.append(item_id)
+        if item_id not in self.FILES:
+            raise IOError("not found")
+        return self.FILES[item_id]
+
+
+class TestValidation(TestCase):
+    def test_valid(self):
+        bom = b"\xef\xbb\xbf"
+        for extension, content in [
+            (".srt", SRT),
+            (".srt", bom + SRT),
+            (".srt", "\ufeff".encode("utf-16-le") + SRT.decode().encode("utf-16-le")),
+            (".ass", fixture("a4k.net_1608213495_0.ass")),
+            (".zip", fixture("a4k.net_1591786049_0.zip")),
+            (".sub", b"{100}{200}Hello|World\r\n{300}{400}Bye\r\n"),
+            (".smi", b"<SAMI><BODY><SYNC Start=1000><P>Hello</SAMI>"),
+            (
+                ".sup",
+                b"PG"
+                + bytes(8)
+                + b"\x16\x00\x02ab"
+                + b"PG"
+                + bytes(8)
+                + b"\x80\x00\x00",
+            ),
+            (".rar", b"Rar!\x1a\x07\x00" + bytes(100)),
+        ]:
+            self.assertIsNone(validate(extension, content), extension)
+
+    def test_invalid(self):
+        archive = fixture("a4k.net_1591786049_0.zip")
+        corrupt = bytearray(archive)
+        corrupt[1000] ^= 0xFF
+        for extension, content, error in [
+            (".srt", b"<!DOCTYPE html><html><body>404</body></html>", "html page"),
+            (".srt", b"\x00\x01\x02\x03" * 10, "binary content"),
+            (".srt", b"1\r\nno timestamps here\r\n", "no srt cue"),
+            (".ass", fixture("a4k.net_1608213495_0.ass")[:500], "no dialogue"),
+            (".ass", b"[Script Info]\r\nTitle: x\r\n", "no [Events] section"),
+            (".zip", archive[: len(archive) // 2], "bad zip"),
+            (".zip", bytes(corrupt), "bad zip member"),
+            (".zip", b"<html>error</html>", "bad zip"),
+            (".sup", b"PG" + bytes(8) + b"\x16\x00\x10ab", "truncated segment"),
+            (".rar", b"<html>error</html>", "not a rar archive"),
+            (".7z", b"7z\xbc\xaf\x27\x1c" + bytes(26), "bad 7z start header"),
+        ]:
+            self.assertIn(error, validate(extension, content) or "", extension)
+
+    def test_zip_without_subtitle(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("readme.txt", "no subtitle here")
+        self.assertEqual("no subtitle in zip", validate(".zip", buffer.getvalue()))
+
+    def test_search_results_carry_fallback(self):
+        with mock.patch("xbmcplugin.addDirectoryItems") as add_items:
+            FallbackAdapter().search_handler(1, SubtitleSearchInput([], [], "流浪地球"))
+
+        _, items, _ = add_items.call_args[0]
+        params = [
+            SubtitleAdapterBase._get_param_dict(url.split("/", 3)[-1])
+            for url, _, _ in items
+        ]
+        self.assertEqual("/subtitle/2,/subtitle/3,/subtitle/4", params[0]["fallback"])
+        self.assertEqual("/subtitle/5", params[3]["fallback"])
+        self.assertNotIn("fallback", params[4])
+
+    def test_download_falls_back(self):
+        sa = FallbackAdapter()
+        with mock.patch("xbmcplugin.addDirectoryItem") as add_item:
+            sa.router(
+                1,
+                "?action=download&item_id=/subtitle/1&name=name1"
+                "&fallback=/subtitle/2,/subtitle/3,/subtitle/4",
+            )
+
+        # the html page and the failed download are skipped
+        self.assertEqual(["/subtitle/1", "/subtitle/2", "/subtitle/3"], sa.downloads)
+        with open(add_item.call_args[1]["url"], "rb") as f:
+            self.assertEqual(SRT, f.read())
+
+
+class TestRetiming(TestCase):
+    def test_parse_times(self):
+        times = parse_times(".ass", fixture("a4k.net_1608213495_0.ass"))
+        # start times, then end times
+        self.assertEqual(3000, len(times))
+        self.assertEqual([5000, 9870], list(times[:2]))
+        self.assertEqual(7500, times[1500])
+        self.assertEqual([1000, 2500], list(parse_times(".srt", SRT)))
+
+    @parameterized.expand(
+        [
+            (
+                "fps",
+                Retiming.from_fps(25, 24000 / 1001),
+                "00:00:01,043 --> 00:00:02,607",
+            ),
+            ("offset", Retiming.from_offset(-1500), "00:00:00,000 --> 00:00:01,000"),
+            (
+                "points",
+                Retiming.from_points((1000, 2000), (2500, 5000)),
+                "00:00:02,000 --> 00:00:05,000",
+            ),
+        ]
+    )
+    def test_retime_srt(self, _, retiming, cue):
+        self.assertEqual(
+            SRT.replace(b"00:00:01,000 --> 00:00:02,500", cue.encode()),
+            retime(".srt", SRT, retiming),
+        )
+
+    def test_retime_ass(self):
+        content = fixture("a4k.net_1608213495_0.ass")
+        retimed = retime(".ass", content, Retiming.from_offset(1000))
+        self.assertEqual(len(content), len(retimed))
+        self.assertIn(b"Dialogue: 0,0:00:06.00,0:00:08.50,Default", retimed)
+        self.assertEqual(
+            [t + 1000 for t in parse_times(".ass", content)],
+            list(parse_times(".ass", retimed)),
+        )
+
+    def test_retime_utf16(self):
+        content = "\ufeff".encode("utf-16-le") + SRT.decode().encode("utf-16-le")
+        retimed = retime(".srt", content, Retiming.from_offset(1000))
+        self.assertIn("00:00:02,000 --> 00:00:03,500", retimed.decode("utf-16"))
+
+    def test_fps(self):
+        self.assertAlmostEqual(25.0, fps_from_name("Movie.2019.PAL.25fps.srt"))
+        self.assertAlmostEqual(24000 / 1001, fps_from_name("Movie.23.976.srt"))
+        self.assertAlmostEqual(25.0, fps_from_name("Movie.PAL.DVDRip.srt"))
+        self.assertIsNone(fps_from_name("My.Pal.Trigger.2019.srt"))
+        self.assertIsNone(fps_from_name("Movie.2019.1080p.x264.srt"))
+        self.assertAlmostEqual(24000 / 1001, snap_fps("23.98"))
+        self.assertIsNone(snap_fps(""))
+
+    def test_download_retimes(self):
+        sa = FallbackAdapter()
+        with mock.patch("xbmcplugin.addDirectoryItem") as add_item, mock.patch(
+            "xbmcvfs.File", LocalFile
+        ), mock.patch(
+            "xbmc.getInfoLabel",
+            side_effect=lambda label: (
+                "23.976" if label == "Player.Process(VideoFPS)" else ""
+            ),
+        ):
+            sa.router(1, "?action=download&item_id=/subtitle/3&name=Movie.PAL.srt")
+
+        with open(add_item.call_args[1]["url"], "rb") as f:
+            self.assertIn(b"00:00:01,043 --> 00:00:02,607", f.read())
+
+    def test_retime_setting(self):
+        sa = FallbackAdapter()
+        with mock.patch("xbmcplugin.addDirectoryItem") as add_item, mock.patch(
+            "xbmcvfs.File", LocalFile
+        ), mock.patch(
+            "xbmc.getInfoLabel",
+            side_effect=lambda label: (
+                "23.976" if label == "Player.Process(VideoFPS)" else ""
+            ),
+        ), mock.patch.object(
+            xbmcaddon.Addon, "getSettingBool", return_value=False
+        ) as get_setting:
+            sa.router(1, "?action=download&item_id=/subtitle/3&name=Movie.PAL.srt")
+
+        get_setting.assert_called_with("auto_retime")
+        with open(add_item.call_args[1]["url"], "rb") as f:
+            self.assertIn(b"00:00:01,000 --> 00:00:02,500", f.read())